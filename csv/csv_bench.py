@@ -0,0 +1,145 @@
+#/usr/bin/env python
+
+import sys, os, argparse, tempfile, shutil, subprocess, time, json, numpy as np, pandas as pd
+
+CSV_DIFF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "csv_diff.py")
+
+# Rows generated per write, bounding the generator's memory on large runs.
+GENERATE_CHUNK = 500000
+
+# Diff modes, as extra csv_diff.py arguments. Key modes need unique ids and
+# are skipped when duplicates are generated; the warm incremental run reuses
+# the index left by the cold one.
+MODES = [
+    ("memory", []),
+    ("chunked", ["-c", "{chunksize}"]),
+    ("jobs", ["-j", "{jobs}", "-c", "{chunksize}"]),
+    ("key", ["-k", "id"]),
+    ("key-jobs", ["-k", "id", "-j", "{jobs}", "-c", "{chunksize}"]),
+    ("incremental-cold", ["--index-dir", "{workdir}/index", "-c", "{chunksize}"]),
+    ("incremental-warm", ["--index-dir", "{workdir}/index", "-c", "{chunksize}"]),
+]
+
+def synthetic_chunk(rng, start, count, columns):
+    # id, then alternating integer and low-cardinality text columns.
+    data = {"id": np.arange(start, start + count)}
+    for i in range(1, columns):
+        if i % 2:
+            data["c%d" % i] = rng.integers(0, 1000000, count)
+        else:
+            data["c%d" % i] = np.char.add("v", rng.integers(0, 1000, count).astype(str))
+    return pd.DataFrame(data)
+
+def generate(main_file, diff_file, rows, columns, change_ratio, duplicate_rate, seed):
+    # Write a main/diff pair. In the diff file change_ratio of the rows have
+    # one cell modified, and a further quarter of that ratio is removed and
+    # another quarter added. duplicate_rate of the rows are repeated in both
+    # files. Returns the number of rows written to each file.
+    counts = [0, 0]
+    added = rows
+    with open(main_file, "w", newline="") as main_out, open(diff_file, "w", newline="") as diff_out:
+        for n, start in enumerate(range(0, rows, GENERATE_CHUNK)):
+            rng = np.random.default_rng([seed, n])
+            main = synthetic_chunk(rng, start, min(GENERATE_CHUNK, rows - start), columns)
+            diff = main.copy()
+
+            modified = rng.random(len(diff)) < change_ratio
+            if columns > 1:
+                diff.loc[modified, "c1"] = diff.loc[modified, "c1"] + 1
+            removed = rng.random(len(diff)) < change_ratio / 4
+            new = synthetic_chunk(rng, added, int(len(diff) * change_ratio / 4), columns)
+            added += len(new)
+            diff = pd.concat([diff[~removed], new], ignore_index=True)
+
+            if duplicate_rate:
+                dups = main.sample(frac=duplicate_rate, random_state=rng.integers(1 << 31))
+                main = pd.concat([main, dups], ignore_index=True)
+                diff = pd.concat([diff, dups], ignore_index=True)
+
+            main.to_csv(main_out, header=not n, index=False)
+            diff.to_csv(diff_out, header=not n, index=False)
+            counts[0] += len(main)
+            counts[1] += len(diff)
+    return counts
+
+def run_mode(args, workdir):
+    # Run csv_diff.py as a child process so its peak RSS is measured on its
+    # own, from the rusage wait4 returns for it.
+    command = [sys.executable, CSV_DIFF, "-f", os.path.join(workdir, "main.csv"), "-d", os.path.join(workdir, "diff.csv"),
+               "-o", os.path.join(workdir, "output.csv")] + args
+    started = time.monotonic()
+    child = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(child.pid, 0)
+    child.returncode = os.waitstatus_to_exitcode(status)
+    return time.monotonic() - started, usage.ru_maxrss * 1024, child.returncode
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="CSV File Compare Benchmark",
+        epilog="""Generate a synthetic pair of CSV files and time each csv_diff mode on it.
+            One JSON record per mode is written to stdout.""",
+    )
+    parser.add_argument("-r", "--rows", type=int, default=100000, metavar="rows", help="Rows in the main file (default: %(default)s)")
+    parser.add_argument("-n", "--columns", type=int, default=20, metavar="columns", help="Columns per row, including the id (default: %(default)s)")
+    parser.add_argument("--change-ratio", type=float, default=0.01, metavar="ratio", help="Fraction of rows modified in the diff file (default: %(default)s)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, metavar="ratio", help="Fraction of rows repeated in both files (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, metavar="seed", help="Random seed (default: %(default)s)")
+    parser.add_argument("-m", "--modes", metavar="modes", help="Comma separated modes to run (default: all of %s)" % ",".join(m for m, _ in MODES))
+    parser.add_argument("-c", "--chunksize", type=int, default=100000, metavar="rows", help="Chunk size for the chunked modes (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), metavar="N", help="Processes for the parallel modes (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N", help="Runs per mode; the fastest is reported (default: %(default)s)")
+    parser.add_argument("-w", "--workdir", metavar="workdir", help="Keep the generated files here instead of a temporary directory")
+
+    try:
+        args = parser.parse_args()
+    except:
+        sys.exit(1)
+
+    if args.rows < 1 or args.columns < 1 or args.repeat < 1:
+        parser.error("--rows, --columns and --repeat must be at least 1")
+
+    modes = dict(MODES)
+    selected = args.modes.split(",") if args.modes else [m for m, _ in MODES]
+    unknown = [m for m in selected if m not in modes]
+    if unknown:
+        parser.error("unknown mode %s" % ", ".join(unknown))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="csv_bench")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        started = time.monotonic()
+        rows = generate(os.path.join(workdir, "main.csv"), os.path.join(workdir, "diff.csv"),
+                        args.rows, args.columns, args.change_ratio, args.duplicate_rate, args.seed)
+        print(json.dumps({"mode": "generate", "rows": rows, "wall_s": round(time.monotonic() - started, 3)}), flush=True)
+
+        shutil.rmtree(os.path.join(workdir, "index"), ignore_errors=True)
+        for mode in selected:
+            record = {
+                "mode": mode,
+                "rows": sum(rows),
+                "columns": args.columns,
+                "change_ratio": args.change_ratio,
+                "duplicate_rate": args.duplicate_rate,
+            }
+            if args.duplicate_rate and "id" in modes[mode]:
+                record["skipped"] = "key modes need unique ids"
+                print(json.dumps(record), flush=True)
+                continue
+
+            extra = [a.format(chunksize=args.chunksize, jobs=args.jobs, workdir=workdir) for a in modes[mode]]
+            runs = [run_mode(extra, workdir) for _ in range(1 if mode == "incremental-cold" else args.repeat)]
+            wall = min(r[0] for r in runs)
+            record.update({
+                "wall_s": round(wall, 3),
+                "peak_rss_mb": round(max(r[1] for r in runs) / 1048576, 1),
+                "rows_per_s": int(sum(rows) / wall),
+                "exit_code": max(r[2] for r in runs),
+            })
+            print(json.dumps(record), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,11 +1,632 @@
 #/usr/bin/env python
 
-import sys, argparse, pandas as pd
+import sys, os, io, argparse, tempfile, shutil, pickle, json, hashlib, numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of on-disk hash partitions used by the chunked diff. Each one holds
+# 16 bytes per input row and is loaded on its own, so 64 keeps a partition
+# around a gigabyte for inputs of several billion rows.
+PARTITIONS = 64
+
+# 128-bit row fingerprints: two independently keyed 64-bit hashes. Used where
+# rows cannot be re-compared after hashing, so a collision must be unlikely
+# enough to ignore even across billions of rows.
+FINGERPRINT = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+SECOND_HASH_KEY = 'csv_diff_fprint2'
+
+# Bumped whenever the layout of a --index-dir snapshot index changes.
+INDEX_VERSION = 1
+
+# Rows per chunk when partitioning for --jobs without an explicit --chunksize.
+DEFAULT_CHUNKSIZE = 100000
+
+# Text columns with at most this many distinct values per row are cached as
+# categoricals, which store each distinct value once.
+CATEGORY_RATIO = 0.5
+
+# pyarrow is optional. It is needed for Parquet and Arrow files, and its
+# multi-threaded CSV reader is used when the schema is known (its inference
+# differs a little from the C reader).
+try:
+    import pyarrow, pyarrow.ipc, pyarrow.parquet
+    TYPED_ENGINE = 'pyarrow'
+except ImportError:
+    pyarrow = None
+    TYPED_ENGINE = 'c'
+
+def nullable_dtype(arrow_type):
+    # types_mapper for columnar chunks: integer and boolean columns become
+    # pandas' nullable dtypes, so a chunk holding a null keeps the same dtype
+    # (and the same text, 5 rather than 5.0) as one without.
+    if pyarrow.types.is_integer(arrow_type):
+        return pd.api.types.pandas_dtype(('UInt' if pyarrow.types.is_unsigned_integer(arrow_type) else 'Int') + str(arrow_type.bit_width))
+    if pyarrow.types.is_boolean(arrow_type):
+        return pd.BooleanDtype()
+    return None
+
+def file_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    return 'csv'
+
+def open_columnar(path):
+    # Memory-mapped Arrow table for a Parquet or Arrow IPC file; Arrow data
+    # is used in place, Parquet pages are decoded straight from the mapping.
+    if pyarrow is None:
+        sys.exit("%s: reading Parquet/Arrow files requires pyarrow" % path)
+    if file_format(path) == 'parquet':
+        return pyarrow.parquet.ParquetFile(path, memory_map=True)
+    return pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+
+class OutputWriter:
+    # Writes result frames to a CSV, Parquet or Arrow IPC file, chosen by
+    # extension. Frames are appended as they come, so the chunked modes
+    # never hold the whole result.
+
+    def __init__(self, path):
+        self.path = path
+        self.format = file_format(path)
+        self.writer = None
+        self.schema = None
+        if self.format != 'csv' and pyarrow is None:
+            sys.exit("%s: writing Parquet/Arrow files requires pyarrow" % path)
+
+    def write(self, frame):
+        # Empty frames before the first row are skipped: an empty object
+        # column has no Arrow type to fix the file schema with. close()
+        # covers a result without any rows.
+        if self.writer is None:
+            if frame.empty:
+                return
+            self.open(frame)
+        if self.format == 'csv':
+            frame.to_csv(self.writer, header=False, index=False)
+        else:
+            self.writer.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False).cast(self.schema))
+
+    def open(self, frame):
+        # Start the file with the header or schema of frame.
+        if self.format == 'csv':
+            self.writer = open(self.path, 'w', newline='')
+            frame.head(0).to_csv(self.writer, index=False)
+            return
+        self.schema = pyarrow.Schema.from_pandas(frame, preserve_index=False)
+        if self.format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+
+    def close(self, columns):
+        # An empty result still gets a file with the expected columns.
+        if self.writer is None:
+            self.open(pd.DataFrame(columns=columns))
+        self.writer.close()
+
+def write_frame(path, frame):
+    writer = OutputWriter(path)
+    writer.write(frame)
+    writer.close(frame.columns)
+
+def column_filter(columns=None, ignore_columns=None, keys=None):
+    # usecols callable for read_csv, or None to read every column. Key
+    # columns are always kept.
+    if columns is None and not ignore_columns:
+        return None
+    wanted = None if columns is None else set(columns) | set(keys or [])
+    ignored = set(ignore_columns or []) - set(keys or [])
+    return lambda c: (wanted is None or c in wanted) and c not in ignored
+
+def read_header(path, usecols=None):
+    if file_format(path) == 'csv':
+        columns = pd.read_csv(path, nrows=0).columns
+    else:
+        columns = [c for c in open_columnar(path).schema.names if not c.startswith('__index_level_')]
+    return [c for c in columns if usecols is None or usecols(c)]
+
+def text_mode(main_file, diff_file):
+    # Whether the chunked modes compare fields as text: always when a CSV
+    # file is involved, so typed columnar values can meet CSV text.
+    return 'csv' in (file_format(main_file), file_format(diff_file))
+
+def read_chunks(path, chunksize, columns, text=True):
+    # CSV fields are read as text so that all chunks agree on how a row
+    # compares, whatever dtype pandas would have inferred for the chunk.
+    # Parquet and Arrow columns keep their stored types, which are the same
+    # in every chunk (see nullable_dtype), unless text is set. Columns outside columns are never
+    # decoded.
+    if file_format(path) == 'csv':
+        wanted = set(columns)
+        for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize, usecols=lambda c: c in wanted):
+            yield chunk.reindex(columns=columns, fill_value='')
+        return
+
+    source = open_columnar(path)
+    present = [c for c in columns if c in source.schema.names]
+    if file_format(path) == 'parquet':
+        batches = source.iter_batches(batch_size=chunksize, columns=present)
+    else:
+        source = source.select(present)
+        batches = (source.slice(i, chunksize) for i in range(0, source.num_rows, chunksize))
+    for batch in batches:
+        chunk = batch.to_pandas(types_mapper=nullable_dtype)
+        if text:
+            chunk = chunk.astype(object).where(chunk.notna(), '').astype(str)
+        yield chunk.reindex(columns=columns, fill_value='')
+
+def compact_dtypes(csvf):
+    # Inferred dtypes, with repetitive text columns turned into categoricals.
+    # Integers are not narrowed: read_csv wraps values that overflow an
+    # explicit dtype instead of failing.
+    dtypes = {}
+    for column in csvf.columns:
+        series = csvf[column]
+        text = pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)
+        if text and len(series) and series.nunique() <= len(series) * CATEGORY_RATIO:
+            dtypes[column] = 'category'
+        else:
+            dtypes[column] = str(series.dtype)
+    return dtypes
+
+def load_file(path, usecols=None, schema_cache=None):
+    # Read a whole file, skipping unwanted columns. With a schema cache the
+    # dtypes inferred on an earlier run of the same CSV header are reused;
+    # when they no longer fit the data the file is re-inferred and the cache
+    # entry replaced. Parquet and Arrow files carry their own types.
+    columns = read_header(path, usecols)
+    if file_format(path) == 'parquet':
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    if file_format(path) == 'arrow':
+        return open_columnar(path).select(columns).to_pandas()
+    if schema_cache is None:
+        return pd.read_csv(path, usecols=columns)
+
+    cache = {}
+    if os.path.exists(schema_cache):
+        with open(schema_cache) as f:
+            cache = json.load(f)
+    signature = hashlib.sha1(json.dumps(columns).encode('utf-8')).hexdigest()
+
+    if signature in cache:
+        try:
+            return pd.read_csv(path, usecols=columns, dtype=cache[signature], engine=TYPED_ENGINE)
+        except (ValueError, TypeError, OverflowError):
+            pass
+
+    csvf = pd.read_csv(path, usecols=columns)
+    cache[signature] = compact_dtypes(csvf)
+    with open(schema_cache + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(schema_cache + '.tmp', schema_cache)
+    return csvf.astype(cache[signature])
+
+def row_hashes(frame):
+    # One vectorized 64-bit hash per row over all columns of frame.
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+def row_fingerprints(frame):
+    fingerprints = np.empty(len(frame), dtype=FINGERPRINT)
+    fingerprints['hi'] = row_hashes(frame)
+    fingerprints['lo'] = pd.util.hash_pandas_object(frame, index=False, hash_key=SECOND_HASH_KEY).to_numpy()
+    return fingerprints
+
+def member(sorted_values, values):
+    # Mask of values found in the sorted array sorted_values.
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+    return sorted_values[pos] == values
+
+def compare_rows(csvf):
+    # Mask of the rows of csvf that occur exactly once, ignoring the flag
+    # and position columns. Same result as drop_duplicates(keep=False), but
+    # rows are first matched on a 64-bit hash and only rows sharing a hash
+    # are compared on their full values, which also settles the rare hash
+    # collision.
+    values = csvf.columns.difference(['flag', '_pos'])
+    shared = pd.Series(row_hashes(csvf[values])).duplicated(keep=False).to_numpy()
+    keep = ~shared
+    if shared.any():
+        keep[shared] = ~csvf[shared].duplicated(values, keep=False).to_numpy()
+    return keep
+
+def compare_keys(csvf1, csvf2, keys):
+    # Join two frames with the same columns on the key columns and return
+    # removed rows (key only in csvf1), added rows (key only in csvf2) and
+    # modified rows, with the names of the changed columns. Only the keys, a
+    # per-row hash of the other columns and the row positions go through the
+    # hash join; cells are compared only for keys whose hashes differ. The
+    # _group and _pos columns give each row's place in the output.
+    values = [c for c in csvf1.columns if c not in keys and c != '_pos']
+    for name, csvf in (('main', csvf1), ('diff', csvf2)):
+        if csvf.duplicated(keys).any():
+            raise ValueError("%s file: key %s is not unique" % (name, ", ".join(keys)))
+    if '_pos' not in csvf1.columns:
+        csvf1 = csvf1.assign(_pos=np.arange(len(csvf1)))
+        csvf2 = csvf2.assign(_pos=np.arange(len(csvf2)))
+
+    index1 = csvf1[keys].assign(hash=row_hashes(csvf1[values]), pos=np.arange(len(csvf1)))
+    index2 = csvf2[keys].assign(hash=row_hashes(csvf2[values]), pos=np.arange(len(csvf2)))
+    joined = index1.merge(index2, on=keys, how='outer', suffixes=('_main', '_diff'), indicator=True, sort=False)
+
+    removed = joined.loc[joined['_merge'] == 'left_only', 'pos_main'].astype(np.int64)
+    added = joined.loc[joined['_merge'] == 'right_only', 'pos_diff'].astype(np.int64)
+    both = joined[(joined['_merge'] == 'both') & (joined['hash_main'] != joined['hash_diff'])]
+
+    # Differing hashes can still hold equal values (1 and 1.0 across files
+    # with different inferred dtypes), so the cells have the final say.
+    old = csvf1.iloc[both['pos_main'].astype(np.int64)][values].reset_index(drop=True)
+    new = csvf2.iloc[both['pos_diff'].astype(np.int64)][values].reset_index(drop=True)
+    # Categoricals only compare when their categories match.
+    old = old.astype({c: object for c in values if isinstance(old[c].dtype, pd.CategoricalDtype)})
+    new = new.astype({c: object for c in values if isinstance(new[c].dtype, pd.CategoricalDtype)})
+    differs = (old != new) & ~(old.isna() & new.isna())
+    changed = differs.apply(lambda row: ";".join(row.index[row]), axis=1) if len(differs) else pd.Series(dtype=str)
+    modified = csvf2.iloc[both['pos_diff'].astype(np.int64)].reset_index(drop=True)
+    modified = modified.assign(flag='modified', changed=changed, _group=2)[differs.any(axis=1)]
+
+    result = pd.concat([
+        csvf1.iloc[removed].assign(flag='removed', changed='', _group=0),
+        csvf2.iloc[added].assign(flag='added', changed='', _group=1),
+        modified,
+    ])
+    return result.sort_values(['_group', '_pos'], kind='stable')
+
+def memory_diff(main_file, diff_file, output_file, usecols=None, schema_cache=None):
+    csvf1 = load_file(main_file, usecols, schema_cache)
+    csvf2 = load_file(diff_file, usecols, schema_cache)
+
+    csvf1['flag'] = 'main'
+    csvf2['flag'] = 'diff'
+
+    csvf = pd.concat([csvf1, csvf2], ignore_index=True)
+    write_frame(output_file, csvf[compare_rows(csvf)])
+
+def key_diff(main_file, diff_file, output_file, keys, usecols=None, schema_cache=None):
+    csvf1 = load_file(main_file, usecols, schema_cache)
+    csvf2 = load_file(diff_file, usecols, schema_cache)
+
+    for path, csvf in ((main_file, csvf1), (diff_file, csvf2)):
+        missing = [k for k in keys if k not in csvf.columns]
+        if missing:
+            sys.exit("%s: no key column %s" % (path, ", ".join(missing)))
+
+    columns = list(csvf1.columns) + [c for c in csvf2.columns if c not in csvf1.columns]
+    try:
+        result = compare_keys(csvf1.reindex(columns=columns), csvf2.reindex(columns=columns), keys)
+    except ValueError as e:
+        sys.exit(str(e))
+    write_frame(output_file, result.drop(columns=['_group', '_pos']))
+
+def diff_bucket(path, keys):
+    # Worker for partitioned_diff: load one bucket written by the partition
+    # pass, diff it in memory and store the result sorted by output place.
+    frames = {'main': [], 'diff': []}
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                frame = pickle.load(f)
+            except EOFError:
+                break
+            frames[frame['flag'].iat[0]].append(frame)
+    csvf1, csvf2 = [pd.concat(frames[flag], ignore_index=True) if frames[flag] else None for flag in ('main', 'diff')]
+    template = csvf1 if csvf1 is not None else csvf2
+    csvf1 = template.iloc[:0] if csvf1 is None else csvf1
+    csvf2 = template.iloc[:0] if csvf2 is None else csvf2
+
+    if keys:
+        result = compare_keys(csvf1.drop(columns='flag'), csvf2.drop(columns='flag'), keys)
+    else:
+        csvf = pd.concat([csvf1, csvf2], ignore_index=True)
+        result = csvf[compare_rows(csvf)]
+        result = result.assign(_group=(result['flag'] == 'diff').astype(int))
+        result = result.sort_values(['_group', '_pos'], kind='stable')
+
+    with open(path + '.out', 'wb') as f:
+        pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+    return path + '.out'
+
+def partitioned_diff(main_file, diff_file, output_file, chunksize, jobs, keys=None, usecols=None):
+    # Spread the rows of both files over on-disk buckets by a hash of the
+    # key columns, or of the whole row, so rows that can match always share
+    # a bucket. Buckets are diffed independently in a pool of jobs processes
+    # and their results merged back into the order the in-memory diff would
+    # write. Fields are compared as text, as in chunked_diff.
+    columns = read_header(main_file, usecols)
+    columns += [c for c in read_header(diff_file, usecols) if c not in columns]
+    missing = [k for k in keys or [] if k not in columns]
+    if missing:
+        sys.exit("no key column %s" % ", ".join(missing))
+    buckets = max(jobs, PARTITIONS)
+    text = text_mode(main_file, diff_file)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, str(i)) for i in range(buckets)]
+        parts = [open(path, 'wb') for path in paths]
+        for path, flag in ((main_file, 'main'), (diff_file, 'diff')):
+            pos = 0
+            for chunk in read_chunks(path, chunksize, columns, text):
+                hashes = row_hashes(chunk[keys] if keys else chunk)
+                chunk = chunk.assign(flag=flag, _pos=np.arange(pos, pos + len(chunk)))
+                pos += len(chunk)
+                for i, part in chunk.groupby(hashes % buckets, sort=False):
+                    pickle.dump(part, parts[i], pickle.HIGHEST_PROTOCOL)
+        for part in parts:
+            part.close()
+        paths = [path for path in paths if os.path.getsize(path)]
+
+        try:
+            if jobs > 1:
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    outputs = list(pool.map(diff_bucket, paths, [keys] * len(paths)))
+            else:
+                outputs = [diff_bucket(path, keys) for path in paths]
+        except ValueError as e:
+            sys.exit(str(e))
+
+        results = []
+        for path in outputs:
+            with open(path, 'rb') as f:
+                results.append(pickle.load(f))
+
+    if keys:
+        columns += ['flag', 'changed']
+    else:
+        columns += ['flag']
+    if results:
+        result = pd.concat(results).sort_values(['_group', '_pos'], kind='stable')
+    else:
+        result = pd.DataFrame(columns=columns)
+    write_frame(output_file, result[columns])
+
+def chunked_diff(main_file, diff_file, output_file, chunksize, usecols=None):
+    # A row is written when it occurs exactly once across both files, the
+    # same rule as memory_diff. The first pass spreads row fingerprints over
+    # partition files on disk and keeps only the fingerprints seen once; the
+    # second pass re-reads both files and writes the rows carrying those
+    # fingerprints, in file order. CSV fields stay text (see read_chunks), so
+    # values the memory modes would parse as equal, or print differently,
+    # are compared and written as they stand in the file.
+    columns = read_header(main_file, usecols)
+    columns += [c for c in read_header(diff_file, usecols) if c not in columns]
+    inputs = [(main_file, 'main'), (diff_file, 'diff')]
+    text = text_mode(main_file, diff_file)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        parts = [open(os.path.join(tmpdir, str(i)), 'wb') for i in range(PARTITIONS)]
+        for path, flag in inputs:
+            for chunk in read_chunks(path, chunksize, columns, text):
+                fingerprints = row_fingerprints(chunk)
+                buckets = fingerprints['hi'] % PARTITIONS
+                order = np.argsort(buckets, kind='stable')
+                bounds = np.searchsorted(buckets[order], np.arange(PARTITIONS + 1))
+                for i in range(PARTITIONS):
+                    fingerprints[order[bounds[i]:bounds[i + 1]]].tofile(parts[i])
+        for part in parts:
+            part.close()
+
+        singles = []
+        for i in range(PARTITIONS):
+            fingerprints = np.fromfile(os.path.join(tmpdir, str(i)), dtype=FINGERPRINT)
+            values, counts = np.unique(fingerprints, return_counts=True)
+            singles.append(values[counts == 1])
+        singles = np.sort(np.concatenate(singles))
+
+    out = OutputWriter(output_file)
+    for path, flag in inputs:
+        for chunk in read_chunks(path, chunksize, columns, text):
+            out.write(chunk[member(singles, row_fingerprints(chunk))].assign(flag=flag))
+    out.close(columns + ['flag'])
+
+def line_offsets(path, rows):
+    # Byte offset of each data row of a CSV file, found by scanning for
+    # newlines without parsing. None when lines and rows do not line up
+    # (quoted newlines, blank lines), or for columnar files.
+    if file_format(path) != 'csv':
+        return None
+    starts, base = [np.zeros(1, dtype=np.int64)], 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 24)
+            if not block:
+                break
+            starts.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + base + 1)
+            base += len(block)
+    starts = np.concatenate(starts)
+    if starts[-1] == base:
+        starts = starts[:-1]
+    if len(starts) - 1 != rows:
+        return None
+    return starts[1:]
+
+def fetch_rows(path, positions, columns, chunksize, text, offsets=None):
+    # Rows at the given sorted positions of a file, with a _pos column. With
+    # line offsets only those rows are read; otherwise the file is scanned.
+    frames = []
+    if offsets is not None:
+        wanted = set(columns)
+        with open(path, 'rb') as f:
+            header = f.readline()
+            for i in range(0, len(positions), chunksize):
+                batch = positions[i:i + chunksize]
+                lines = []
+                for pos in batch:
+                    f.seek(offsets[pos])
+                    line = f.readline()
+                    lines.append(line if line.endswith(b'\n') else line + b'\n')
+                frame = pd.read_csv(io.BytesIO(header + b''.join(lines)), dtype=str, keep_default_na=False, usecols=lambda c: c in wanted)
+                frames.append(frame.reindex(columns=columns, fill_value='').assign(_pos=batch))
+    else:
+        start = 0
+        for chunk in read_chunks(path, chunksize, columns, text):
+            chunk = chunk.assign(_pos=np.arange(start, start + len(chunk)))
+            start += len(chunk)
+            frames.append(chunk[np.isin(chunk['_pos'].to_numpy(), positions)])
+    if not frames:
+        return pd.DataFrame(columns=columns + ['_pos'])
+    return pd.concat(frames, ignore_index=True)
+
+def index_location(index_dir, path):
+    return os.path.join(index_dir, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest())
+
+def index_meta(path, columns, keys, text):
+    # Identifies the exact file contents and comparison an index was built
+    # for; any difference means the index cannot be reused.
+    st = os.stat(path)
+    return {
+        'version': INDEX_VERSION,
+        'path': os.path.abspath(path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'columns': columns,
+        'keys': keys,
+        'text': text,
+    }
+
+def load_index(index_dir, path, columns, keys, text):
+    location = index_location(index_dir, path)
+    try:
+        with open(os.path.join(location, 'meta.json')) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if meta != index_meta(path, columns, keys, text):
+        return None
+    return {
+        name[:-4]: np.load(os.path.join(location, name), mmap_mode='r')
+        for name in os.listdir(location) if name.endswith('.npy')
+    }
+
+def save_index(index_dir, path, columns, keys, text, arrays):
+    # Written to a temporary directory and renamed into place, so an
+    # interrupted run never leaves a half written index behind. Indexes of
+    # files that no longer exist are pruned.
+    os.makedirs(index_dir, exist_ok=True)
+    location = index_location(index_dir, path)
+    tmp = tempfile.mkdtemp(dir=index_dir)
+    for name, array in arrays.items():
+        if array is not None:
+            np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(index_meta(path, columns, keys, text), f)
+    shutil.rmtree(location, ignore_errors=True)
+    os.replace(tmp, location)
+
+    for name in os.listdir(index_dir):
+        try:
+            with open(os.path.join(index_dir, name, 'meta.json')) as f:
+                indexed = json.load(f)['path']
+        except (IOError, ValueError, KeyError):
+            continue
+        if not os.path.exists(indexed):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+def scan_index(path, chunksize, columns, keys, text, visit=None):
+    # One pass over a file computing what its index holds: the sorted row
+    # fingerprints and the row behind each (row mode), or the sorted key
+    # fingerprints with their rows plus a fingerprint of the other columns
+    # of every row (key mode). visit, if given, sees every chunk (with a
+    # _pos column) along with its fingerprints.
+    values = [c for c in columns if c not in (keys or [])]
+    fingerprints, value_fingerprints, start = [], [], 0
+    for chunk in read_chunks(path, chunksize, columns, text):
+        chunk = chunk.assign(_pos=np.arange(start, start + len(chunk)))
+        start += len(chunk)
+        fingerprint = row_fingerprints(chunk[keys or columns])
+        value_fingerprint = row_fingerprints(chunk[values]) if keys else None
+        if visit is not None:
+            visit(chunk, fingerprint, value_fingerprint)
+        fingerprints.append(fingerprint)
+        value_fingerprints.append(value_fingerprint)
+
+    fingerprints = np.concatenate(fingerprints) if fingerprints else np.empty(0, dtype=FINGERPRINT)
+    order = np.argsort(fingerprints, kind='stable')
+    arrays = {
+        'sorted': fingerprints[order],
+        'order': order,
+        'values': np.concatenate(value_fingerprints) if keys and value_fingerprints else None,
+        'offsets': line_offsets(path, start),
+    }
+    if keys and len(order) > 1 and (arrays['sorted'][1:] == arrays['sorted'][:-1]).any():
+        sys.exit("%s: key %s is not unique" % (path, ", ".join(keys)))
+    return arrays
+
+def incremental_diff(main_file, diff_file, output_file, chunksize, index_dir, keys=None, usecols=None):
+    # Diff against a snapshot index of main_file kept in index_dir, so only
+    # diff_file is scanned: rows of main_file are read back (by byte offset
+    # where possible) only when they are part of the result. The index of
+    # diff_file is saved along the way, ready for the next run where it is
+    # the main file. Output matches chunked_diff, or partitioned_diff with
+    # --key. Without a usable index, main_file is scanned once to build it.
+    columns = read_header(main_file, usecols)
+    columns += [c for c in read_header(diff_file, usecols) if c not in columns]
+    missing = [k for k in keys or [] if k not in columns]
+    if missing:
+        sys.exit("no key column %s" % ", ".join(missing))
+
+    text = text_mode(main_file, diff_file)
+    main = load_index(index_dir, main_file, columns, keys, text)
+    if main is None:
+        main = scan_index(main_file, chunksize, columns, keys, text)
+        save_index(index_dir, main_file, columns, keys, text, main)
+
+    # Diff rows that can end up in the result: rows absent from main_file,
+    # and with --key rows whose other columns changed.
+    candidates, fingerprints, changed = [], [], []
+    seen = np.zeros(len(main['order']), dtype=bool)
+
+    def visit(chunk, fingerprint, value_fingerprint):
+        found = member(main['sorted'], fingerprint)
+        if keys:
+            index = np.searchsorted(main['sorted'], fingerprint[found])
+            rows = np.asarray(main['order'][index])
+            seen[rows] = True
+            modified = main['values'][rows] != value_fingerprint[found]
+            changed.append(rows[modified])
+            keep = ~found
+            keep[np.flatnonzero(found)[modified]] = True
+        else:
+            keep = ~found
+        candidates.append(chunk[keep])
+        fingerprints.append(fingerprint[keep])
+
+    diff = scan_index(diff_file, chunksize, columns, keys, text, visit)
+    candidates = pd.concat(candidates, ignore_index=True) if candidates else pd.DataFrame(columns=columns + ['_pos'])
+
+    if keys:
+        removed = np.flatnonzero(~seen)
+        positions = np.union1d(removed, np.concatenate(changed) if changed else removed[:0])
+        old = fetch_rows(main_file, positions, columns, chunksize, text, main.get('offsets'))
+        result = compare_keys(old, candidates, keys).drop(columns=['_group', '_pos'])
+    else:
+        # Diff rows seen once in diff_file, and main rows seen once in
+        # main_file that diff_file does not have.
+        fingerprint = np.concatenate(fingerprints) if fingerprints else np.empty(0, dtype=FINGERPRINT)
+        counts = np.searchsorted(diff['sorted'], fingerprint, side='right') - np.searchsorted(diff['sorted'], fingerprint, side='left')
+        added = candidates[counts == 1].drop(columns='_pos').assign(flag='diff')
+
+        ordered = np.asarray(main['sorted'])
+        if len(ordered):
+            starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+            lengths = np.diff(np.append(starts, len(ordered)))
+            single = starts[lengths == 1]
+            single = single[~member(diff['sorted'], ordered[single])]
+            positions = np.sort(np.asarray(main['order'])[single])
+        else:
+            positions = np.empty(0, dtype=np.int64)
+        removed = fetch_rows(main_file, positions, columns, chunksize, text, main.get('offsets'))
+        result = pd.concat([removed.drop(columns='_pos').assign(flag='main'), added], ignore_index=True)
+
+    write_frame(output_file, result)
+    save_index(index_dir, diff_file, columns, keys, text, diff)
 
 def main(argv):
     parser = argparse.ArgumentParser(
         description="CSV File Compare",
-        epilog="""Pass two CSV files as arguments, compare the files and output to a new file.""",
+        epilog="""Pass two CSV files as arguments, compare the files and output to a new file.
+            Parquet (.parquet) and Arrow IPC (.arrow, .feather) files are read directly.""",
     )
     parser.add_argument(
         "-f",
@@ -21,22 +642,92 @@ def main(argv):
 	metavar="diff_file",
         help="File to compare with",
     )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        default="output_file.csv",
+        metavar="output_file",
+        help="File to write the differences to; .parquet and .arrow/.feather write columnar files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        type=int,
+        metavar="rows",
+        help="Stream both files in chunks of this many rows instead of loading them into memory. "
+        "CSV fields are then compared and written as they appear in the file, while the in-memory "
+        "modes infer types: 1.0 and 1 are equal there but not here, and an integer column with "
+        "an empty cell is written as 60.0 in memory but as 60 in chunks",
+    )
+
+    parser.add_argument(
+        "-k",
+        "--key",
+        metavar="columns",
+        help="Comma separated key columns; report added, removed and modified rows by key instead of whole rows",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Hash-partition both files and diff the partitions in N processes",
+    )
+
+    parser.add_argument(
+        "--columns",
+        metavar="columns",
+        help="Comma separated columns to compare; all other columns are skipped while parsing",
+    )
+    parser.add_argument(
+        "--ignore-columns",
+        metavar="columns",
+        help="Comma separated columns to skip while parsing",
+    )
+    parser.add_argument(
+        "--index-dir",
+        metavar="index_dir",
+        help="Keep fingerprint indexes of compared files here; when main_file was indexed by an earlier run only diff_file is scanned",
+    )
+    parser.add_argument(
+        "--schema-cache",
+        metavar="schema_cache",
+        help="JSON file caching the dtypes inferred for each header, reused on later runs",
+    )
 
     try:
         args = parser.parse_args()
     except:
         sys.exit(1)
 
-    csvf1 = pd.read_csv(args.main_file)
-    csvf2 = pd.read_csv(args.diff_file)
+    if args.chunksize is not None and args.chunksize < 1:
+        parser.error("--chunksize must be at least 1")
 
-    csvf1['flag'] = 'main'
-    csvf2['flag'] = 'diff'
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    keys = args.key.split(',') if args.key else None
+    usecols = column_filter(
+        args.columns.split(',') if args.columns else None,
+        args.ignore_columns.split(',') if args.ignore_columns else None,
+        keys,
+    )
 
-    csvf = pd.concat([csvf1, csvf2])
+    if args.index_dir and args.jobs > 1:
+        parser.error("--index-dir cannot be combined with --jobs")
 
-    dups_dropped = csvf.drop_duplicates(csvf.columns.difference(['flag']), keep=False)
-    dups_dropped.to_csv('output_file.csv', index=False)
+    if args.index_dir:
+        incremental_diff(args.main_file, args.diff_file, args.output_file, args.chunksize or DEFAULT_CHUNKSIZE, args.index_dir, keys, usecols)
+    elif args.jobs > 1 or (keys and args.chunksize):
+        partitioned_diff(args.main_file, args.diff_file, args.output_file, args.chunksize or DEFAULT_CHUNKSIZE, args.jobs, keys, usecols)
+    elif keys:
+        key_diff(args.main_file, args.diff_file, args.output_file, keys, usecols, args.schema_cache)
+    elif args.chunksize:
+        chunked_diff(args.main_file, args.diff_file, args.output_file, args.chunksize, usecols)
+    else:
+        memory_diff(args.main_file, args.diff_file, args.output_file, usecols, args.schema_cache)
     return
 
 if __name__ == "__main__":
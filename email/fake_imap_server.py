@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+--------------------------------------------------------------------------
+Program     : fake_imap_server.py
+Version     : v1.0-STABLE-2026-10-18
+Description : In-process fake IMAP server for testing mailbox-archiver.py
+Syntax      : python3 fake_imap_server.py (--messages N) (--latency S)
+Author      : Andrew (andrew@devnull.uk)
+--------------------------------------------------------------------------
+"""
+
+import argparse
+import random
+import re
+import socketserver
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+VERSION = "v1.0-STABLE"
+DEFAULT_CAPABILITIES = ("IMAP4rev1", "MOVE", "UIDPLUS")
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+# Parentheses, quoted strings, {n} literals, and atoms with any [section]<partial>
+TOKEN = re.compile(
+    rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}|[^\s()"]+(?:\[[^\]]*\])?(?:<[\d.]+>)?'
+)
+HEADER_LINE = re.compile(rb"^([^:\r\n]+):[^\r\n]*(?:\r\n[ \t][^\r\n]*)*", re.M)
+
+
+class Message:
+    """One stored message: UID, flags, INTERNALDATE and raw RFC 822 bytes."""
+
+    def __init__(self, uid, raw, internaldate, flags=()):
+        self.uid = uid
+        self.raw = raw
+        self.internaldate = internaldate
+        self.flags = set(flags)
+        self.sent = sent_date(raw)
+
+
+class Mailbox:
+    """A folder: messages in sequence order plus UIDVALIDITY/UIDNEXT."""
+
+    def __init__(self, name, uidvalidity):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []
+
+    def append(self, raw, internaldate, flags=()):
+        message = Message(self.uidnext, raw, internaldate, flags)
+        self.uidnext += 1
+        self.messages.append(message)
+        return message
+
+
+def sent_date(raw):
+    """Date header of a raw message as an aware datetime, or None."""
+    match = re.search(rb"^Date:[ \t]*(.*)$", raw.split(b"\r\n\r\n", 1)[0], re.I | re.M)
+    if not match:
+        return None
+    try:
+        parsed = parsedate_to_datetime(match.group(1).decode("ascii", "ignore").strip())
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def imap_date(value):
+    """Parse an IMAP search date (1-Feb-2024)."""
+    day, month, year = value.split("-")
+    month = MONTHS.index(month.capitalize()) + 1
+    return datetime(int(year), month, int(day), tzinfo=timezone.utc)
+
+
+def internaldate_string(value):
+    """Format a datetime as a quoted IMAP INTERNALDATE."""
+    month = MONTHS[value.month - 1]
+    return f'"{value.day:02d}-{month}-{value.year} {value.strftime("%H:%M:%S %z")}"'
+
+
+def parse_set(value, largest):
+    """Expand an IMAP sequence/UID set (1:5,7,9:*) against the largest value."""
+    result = set()
+    for part in value.split(","):
+        if ":" in part:
+            first, last = part.split(":")
+            first = largest if first == "*" else int(first)
+            last = largest if last == "*" else int(last)
+            result.update(range(min(first, last), max(first, last) + 1))
+        else:
+            result.add(largest if part == "*" else int(part))
+    return result
+
+
+def synthetic_message(rng, index, now, years, invalid_rate):
+    """Build one synthetic message and its INTERNALDATE."""
+    received = now - timedelta(seconds=rng.randint(0, int(years * 365 * 86400)))
+    if rng.random() < invalid_rate:
+        date_header = rng.choice([b"", b"Date: not a date\r\n"])
+    else:
+        date_header = b"Date: " + format_datetime(received).encode("ascii") + b"\r\n"
+    body = b"Synthetic message %d.\r\n" % index * rng.randint(1, 20)
+    raw = (
+        date_header
+        + b"From: Sender %d <sender%d@example.com>\r\n" % (index % 97, index % 97)
+        + b"Subject: Test message %d\r\n" % index
+        + b"Message-ID: <%d@fake.example.com>\r\n" % index
+        + b"\r\n"
+        + body
+    )
+    return raw, received
+
+
+class FakeImapState:
+    """Mailboxes and counters shared by every connection of a server."""
+
+    def __init__(self, folders, delimiter, capabilities, latency):
+        self.lock = threading.RLock()
+        self.delimiter = delimiter
+        self.capabilities = capabilities
+        self.latency = latency
+        self.commands = Counter()
+        self.connections = 0
+        self.max_connections = 0
+        self.active = 0
+        self.mailboxes = {}
+        for name in folders:
+            self.create(name)
+
+    def create(self, name):
+        """Add an empty mailbox; False if it already exists."""
+        if name in self.mailboxes:
+            return False
+        self.mailboxes[name] = Mailbox(name, int(time.time()) + len(self.mailboxes))
+        return True
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    """Speaks the subset of IMAP4rev1 mailbox-archiver.py uses."""
+
+    # Responses are buffered and flushed once per command, like a real
+    # server, so multi-line replies do not trip over delayed ACKs.
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.state = self.server.state
+        self.selected = None
+        with self.state.lock:
+            self.state.connections += 1
+            self.state.active += 1
+            self.state.max_connections = max(
+                self.state.max_connections, self.state.active
+            )
+
+    def finish(self):
+        with self.state.lock:
+            self.state.active -= 1
+        super().finish()
+
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def read_command(self):
+        """Read one command line, resolving {n} literals into the tokens."""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        data = line.rstrip(b"\r\n")
+        tokens = []
+        while True:
+            literal = re.search(rb"\{(\d+)\}$", data)
+            if not literal:
+                tokens.extend(self.tokenize(data))
+                return tokens
+            tokens.extend(self.tokenize(data[: literal.start()]))
+            self.send("+ Ready\r\n")
+            self.wfile.flush()
+            tokens.append(self.rfile.read(int(literal.group(1))))
+            data = self.rfile.readline().rstrip(b"\r\n")
+
+    @staticmethod
+    def tokenize(data):
+        """Split a command into atoms, strings and nested lists."""
+        stack = [[]]
+        for match in TOKEN.finditer(data):
+            token = match.group(0)
+            if token == b"(":
+                stack.append([])
+            elif token == b")":
+                group = stack.pop()
+                stack[-1].append(group)
+            elif token.startswith(b'"'):
+                stack[-1].append(re.sub(rb"\\(.)", rb"\1", token[1:-1]))
+            else:
+                stack[-1].append(token)
+        return stack[0]
+
+    def handle(self):
+        capabilities = " ".join(self.state.capabilities)
+        self.send(f"* OK [CAPABILITY {capabilities}] Fake IMAP ready\r\n")
+        self.wfile.flush()
+        while True:
+            tokens = self.read_command()
+            if not tokens:
+                return
+            tag, command, args = tokens[0].decode(), tokens[1].decode().upper(), tokens[2:]
+            uid = command == "UID"
+            if uid:
+                command, args = args[0].decode().upper(), args[1:]
+            with self.state.lock:
+                self.state.commands[("UID " if uid else "") + command] += 1
+            if self.state.latency:
+                time.sleep(self.state.latency)
+            method = getattr(self, "cmd_" + command.lower(), None)
+            try:
+                with self.state.lock:
+                    if method:
+                        status = method(tag, args, uid)
+                    else:
+                        status = f"{tag} BAD Unknown command {command}\r\n"
+            except Exception as e:
+                status = f"{tag} BAD {type(e).__name__}: {e}\r\n"
+            self.send(status)
+            self.wfile.flush()
+            if command == "LOGOUT":
+                return
+
+    def mailbox(self, name):
+        name = name.decode("utf-8") if isinstance(name, bytes) else name
+        return self.state.mailboxes.get("INBOX" if name.upper() == "INBOX" else name)
+
+    def cmd_capability(self, tag, args, uid):
+        self.send("* CAPABILITY " + " ".join(self.state.capabilities) + "\r\n")
+        return f"{tag} OK CAPABILITY completed\r\n"
+
+    def cmd_noop(self, tag, args, uid):
+        return f"{tag} OK NOOP completed\r\n"
+
+    def cmd_login(self, tag, args, uid):
+        return f"{tag} OK LOGIN completed\r\n"
+
+    def cmd_logout(self, tag, args, uid):
+        self.send("* BYE Fake IMAP logging out\r\n")
+        return f"{tag} OK LOGOUT completed\r\n"
+
+    def cmd_list(self, tag, args, uid):
+        pattern = args[1].decode("utf-8") if len(args) > 1 else "*"
+        delimiter = self.state.delimiter
+        regex = re.compile(
+            "^"
+            + re.escape(pattern)
+            .replace(r"\*", ".*")
+            .replace("%", "[^" + re.escape(delimiter) + "]*")
+            + "$"
+        )
+        for name in sorted(self.state.mailboxes):
+            if regex.match(name):
+                self.send(f'* LIST (\\HasNoChildren) "{delimiter}" "{name}"\r\n')
+        return f"{tag} OK LIST completed\r\n"
+
+    def cmd_create(self, tag, args, uid):
+        if not self.state.create(args[0].decode("utf-8")):
+            return f"{tag} NO [ALREADYEXISTS] Mailbox exists\r\n"
+        return f"{tag} OK CREATE completed\r\n"
+
+    def cmd_delete(self, tag, args, uid):
+        mailbox = self.mailbox(args[0])
+        if mailbox is None:
+            return f"{tag} NO [NONEXISTENT] No such mailbox\r\n"
+        del self.state.mailboxes[mailbox.name]
+        if self.selected is mailbox:
+            self.selected = None
+        return f"{tag} OK DELETE completed\r\n"
+
+    def cmd_status(self, tag, args, uid):
+        mailbox = self.mailbox(args[0])
+        if mailbox is None:
+            return f"{tag} NO [NONEXISTENT] No such mailbox\r\n"
+        self.send(
+            f'* STATUS "{mailbox.name}" (MESSAGES {len(mailbox.messages)} '
+            f"UIDNEXT {mailbox.uidnext} UIDVALIDITY {mailbox.uidvalidity})\r\n"
+        )
+        return f"{tag} OK STATUS completed\r\n"
+
+    def cmd_select(self, tag, args, uid):
+        mailbox = self.mailbox(args[0])
+        if mailbox is None:
+            self.selected = None
+            return f"{tag} NO [NONEXISTENT] No such mailbox\r\n"
+        self.selected = mailbox
+        self.send(f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n")
+        self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n")
+        self.send(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n")
+        self.send("* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n")
+        return f"{tag} OK [READ-WRITE] SELECT completed\r\n"
+
+    cmd_examine = cmd_select
+
+    def cmd_close(self, tag, args, uid):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        self.selected.messages = [
+            m for m in self.selected.messages if "\\Deleted" not in m.flags
+        ]
+        self.selected = None
+        return f"{tag} OK CLOSE completed\r\n"
+
+    def targets(self, value, uid):
+        """Messages addressed by a sequence or UID set, with sequence numbers."""
+        messages = self.selected.messages
+        if uid:
+            wanted = parse_set(value.decode(), messages[-1].uid if messages else 0)
+            return [(i + 1, m) for i, m in enumerate(messages) if m.uid in wanted]
+        wanted = parse_set(value.decode(), len(messages))
+        return [(i, messages[i - 1]) for i in sorted(wanted) if 0 < i <= len(messages)]
+
+    def matches(self, message, criteria, seq):
+        """Evaluate a SEARCH key list (implicit AND) against one message."""
+        i = 0
+        while i < len(criteria):
+            key = criteria[i]
+            if isinstance(key, list):
+                if not self.matches(message, key, seq):
+                    return False
+                i += 1
+                continue
+            key = key.decode().upper()
+            if key == "ALL":
+                i += 1
+            elif key in ("BEFORE", "SINCE", "ON", "SENTBEFORE", "SENTSINCE", "SENTON"):
+                value = imap_date(criteria[i + 1].decode())
+                date = message.sent if key.startswith("SENT") else message.internaldate
+                if date is None:
+                    return False
+                day = date.astimezone(timezone.utc).replace(
+                    hour=0, minute=0, second=0, microsecond=0
+                )
+                if key.endswith("BEFORE") and not day < value:
+                    return False
+                if key.endswith("SINCE") and not day >= value:
+                    return False
+                if key.endswith("ON") and day != value:
+                    return False
+                i += 2
+            elif key == "UID":
+                largest = self.selected.messages[-1].uid
+                if message.uid not in parse_set(criteria[i + 1].decode(), largest):
+                    return False
+                i += 2
+            elif key in ("DELETED", "UNDELETED"):
+                if ("\\Deleted" in message.flags) != (key == "DELETED"):
+                    return False
+                i += 1
+            elif key == "NOT":
+                if self.matches(message, [criteria[i + 1]], seq):
+                    return False
+                i += 2
+            elif re.match(r"^[\d:*,]+$", key):
+                if seq not in parse_set(key, len(self.selected.messages)):
+                    return False
+                i += 1
+            else:
+                raise ValueError(f"unsupported search key {key}")
+        return True
+
+    def cmd_search(self, tag, args, uid):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        if args and args[0].upper() == b"CHARSET":
+            args = args[2:]
+        found = [
+            str(m.uid if uid else seq)
+            for seq, m in enumerate(self.selected.messages, 1)
+            if self.matches(m, args, seq)
+        ]
+        self.send("* SEARCH" + "".join(" " + f for f in found) + "\r\n")
+        return f"{tag} OK SEARCH completed\r\n"
+
+    def fetch_item(self, message, item):
+        """Render one FETCH data item as bytes."""
+        name = item.decode().upper()
+        if name == "UID":
+            return b"UID %d" % message.uid
+        if name == "FLAGS":
+            return b"FLAGS (" + " ".join(sorted(message.flags)).encode() + b")"
+        if name == "INTERNALDATE":
+            return b"INTERNALDATE " + internaldate_string(message.internaldate).encode()
+        if name == "RFC822.SIZE":
+            return b"RFC822.SIZE %d" % len(message.raw)
+        header, _, _ = message.raw.partition(b"\r\n\r\n")
+        if name in ("RFC822.HEADER", "BODY.PEEK[HEADER]", "BODY[HEADER]"):
+            data, label = header + b"\r\n\r\n", name.replace(".PEEK", "")
+        elif name in ("RFC822", "BODY.PEEK[]", "BODY[]"):
+            data, label = message.raw, name.replace(".PEEK", "")
+            if not name.startswith("BODY.PEEK") and name != "RFC822":
+                message.flags.add("\\Seen")
+        elif name.startswith(("BODY.PEEK[HEADER.FIELDS", "BODY[HEADER.FIELDS")):
+            fields = set(re.search(r"\((.*)\)", name).group(1).split())
+            kept = [
+                m.group(0)
+                for m in HEADER_LINE.finditer(header)
+                if m.group(1).decode("ascii", "ignore").upper() in fields
+            ]
+            data = b"\r\n".join(kept) + b"\r\n\r\n"
+            label = name.replace(".PEEK", "")
+        else:
+            raise ValueError(f"unsupported fetch item {name}")
+        return label.encode() + b" {%d}\r\n" % len(data) + data
+
+    def cmd_fetch(self, tag, args, uid):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        flat = []
+        for item in items:
+            # HEADER.FIELDS (A B) arrives as an atom followed by a list.
+            if isinstance(item, list):
+                flat[-1] = flat[-1].rstrip(b"]") + b" (" + b" ".join(item) + b")]"
+            elif item == b"]" and flat and flat[-1].endswith(b")]"):
+                continue
+            else:
+                flat.append(item)
+        if uid and not any(i.upper() == b"UID" for i in flat):
+            flat.insert(0, b"UID")
+        for seq, message in self.targets(args[0], uid):
+            parts = [self.fetch_item(message, item) for item in flat]
+            self.send(b"* %d FETCH (" % seq + b" ".join(parts) + b")\r\n")
+        return f"{tag} OK FETCH completed\r\n"
+
+    def cmd_store(self, tag, args, uid):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        mode = args[1].decode().upper()
+        flags = args[2] if isinstance(args[2], list) else [args[2]]
+        flags = {f.decode() for f in flags}
+        for seq, message in self.targets(args[0], uid):
+            if mode.startswith("+"):
+                message.flags |= flags
+            elif mode.startswith("-"):
+                message.flags -= flags
+            else:
+                message.flags = set(flags)
+            if not mode.endswith(".SILENT"):
+                self.send(f"* {seq} FETCH (FLAGS ({' '.join(sorted(message.flags))}))\r\n")
+        return f"{tag} OK STORE completed\r\n"
+
+    def cmd_copy(self, tag, args, uid, move=False):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        destination = self.mailbox(args[1])
+        if destination is None:
+            return f"{tag} NO [TRYCREATE] No such mailbox\r\n"
+        targets = self.targets(args[0], uid)
+        source_uids, destination_uids = [], []
+        for _, message in targets:
+            copy = destination.append(
+                message.raw, message.internaldate, message.flags - {"\\Deleted"}
+            )
+            source_uids.append(str(message.uid))
+            destination_uids.append(str(copy.uid))
+        code = (
+            f"COPYUID {destination.uidvalidity} "
+            f"{','.join(source_uids)} {','.join(destination_uids)}"
+        )
+        if move:
+            self.send(f"* OK [{code}] Moved\r\n")
+            self.expunge({id(m) for _, m in targets})
+            return f"{tag} OK MOVE completed\r\n"
+        return f"{tag} OK [{code}] COPY completed\r\n"
+
+    def cmd_move(self, tag, args, uid):
+        return self.cmd_copy(tag, args, uid, move=True)
+
+    def expunge(self, wanted):
+        """Remove the given messages, announcing sequence numbers high to low."""
+        messages = self.selected.messages
+        for seq in range(len(messages), 0, -1):
+            if id(messages[seq - 1]) in wanted:
+                del messages[seq - 1]
+                self.send(f"* {seq} EXPUNGE\r\n")
+
+    def cmd_expunge(self, tag, args, uid):
+        if self.selected is None:
+            return f"{tag} BAD No mailbox selected\r\n"
+        if uid:
+            candidates = self.targets(args[0], True)
+        else:
+            candidates = list(enumerate(self.selected.messages, 1))
+        self.expunge({id(m) for _, m in candidates if "\\Deleted" in m.flags})
+        return f"{tag} OK EXPUNGE completed\r\n"
+
+
+class FakeImapServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded fake IMAP server on localhost, seeded with synthetic mail.
+
+    messages are spread over the first folder; latency seconds are slept
+    before answering every command, and commands counts every command by
+    name so callers can derive round trips.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        messages=1000,
+        folders=("INBOX", "Archive", "Sent"),
+        latency=0.0,
+        years=5,
+        invalid_rate=0.01,
+        seed=0,
+        delimiter=".",
+        capabilities=DEFAULT_CAPABILITIES,
+        port=0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeImapHandler)
+        self.state = FakeImapState(folders, delimiter, capabilities, latency)
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        seeded = [
+            synthetic_message(rng, i, now, years, invalid_rate) for i in range(messages)
+        ]
+        for raw, received in sorted(seeded, key=lambda m: m[1]):
+            self.state.mailboxes[folders[0]].append(raw, received)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def commands(self):
+        return self.state.commands
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1143, help="Port to listen on.")
+    parser.add_argument(
+        "--messages", type=int, default=1000, help="Synthetic messages in INBOX."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to sleep per command."
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for synthetic mail."
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = FakeImapServer(
+        args.messages, latency=args.latency, seed=args.seed, port=args.port
+    )
+    print(
+        f"{VERSION} - Fake IMAP server on 127.0.0.1:{server.port} "
+        f"with {args.messages} messages."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Commands: {dict(server.commands)}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+--------------------------------------------------------------------------
+Program     : mailbox-archiver-bench.py
+Version     : v1.0-STABLE-2026-10-18
+Description : Throughput benchmark for mailbox-archiver.py on a fake IMAP server
+Syntax      : python3 mailbox-archiver-bench.py (--messages N) (--latency S)
+              (--modes unbatched,batched,...) (--repeat N) (--no-move)
+Author      : Andrew (andrew@devnull.uk)
+--------------------------------------------------------------------------
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import time
+
+from fake_imap_server import FakeImapServer
+
+VERSION = "v1.0-STABLE"
+ARCHIVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mailbox-archiver.py")
+# Archiver settings per mode, as mailbox-archiver.py arguments
+MODES = [
+    ("unbatched", ["--batch-size", "1"]),
+    ("batched", []),
+    ("parallel", ["--connections", "4"]),
+    ("sent-search", ["--date-source", "sent"]),
+    ("internal-search", ["--date-source", "internal"]),
+]
+
+
+def load_archiver():
+    """Import mailbox-archiver.py, whose name is not a valid module name.
+
+    Its logging is silenced so only the benchmark records reach stdout.
+    """
+    spec = importlib.util.spec_from_file_location("mailbox_archiver", ARCHIVER)
+    archiver = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(archiver)
+    archiver.log.setLevel(logging.CRITICAL)
+    return archiver
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Time each mailbox-archiver.py mode against a fake IMAP server "
+        "seeded with synthetic mail. One JSON record per mode is written to stdout."
+    )
+    parser.add_argument(
+        "--messages", type=int, default=5000, help="Synthetic messages (default: 5000)."
+    )
+    parser.add_argument(
+        "--years",
+        type=float,
+        default=10,
+        help="Years the message dates are spread over (default: 10).",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="Seconds the server sleeps per command (default: 0.005).",
+    )
+    parser.add_argument(
+        "--invalid-rate",
+        type=float,
+        default=0.01,
+        help="Fraction of messages with a missing or bad Date header (default: 0.01).",
+    )
+    parser.add_argument(
+        "--no-move",
+        action="store_true",
+        help="Leave MOVE out of the server capabilities, forcing COPY/STORE/EXPUNGE.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    parser.add_argument(
+        "--modes",
+        help="Comma separated modes to run (default: all of "
+        + ",".join(name for name, _ in MODES)
+        + ").",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Runs per mode; the fastest is reported (default: 1).",
+    )
+    args = parser.parse_args()
+    modes = dict(MODES)
+    args.modes = args.modes.split(",") if args.modes else [name for name, _ in MODES]
+    unknown = [name for name in args.modes if name not in modes]
+    if unknown:
+        parser.error(f"unknown mode {', '.join(unknown)}")
+    if args.messages < 1 or args.repeat < 1:
+        parser.error("--messages and --repeat must be at least 1")
+    return args
+
+
+def run_mode(archiver, args, extra):
+    """Archive a freshly seeded server once and return the run's measurements."""
+    server_args = dict(
+        latency=args.latency,
+        years=args.years,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+    if args.no_move:
+        server_args["capabilities"] = ("IMAP4rev1", "UIDPLUS")
+    with FakeImapServer(args.messages, **server_args) as server:
+        account = archiver.default_account()
+        account.update(
+            name="bench",
+            server="127.0.0.1",
+            port=server.port,
+            ssl=False,
+            username="bench",
+            password="bench",
+        )
+        saved_argv = sys.argv
+        sys.argv = [ARCHIVER] + extra
+        try:
+            archive_args = archiver.parse_args()
+        finally:
+            sys.argv = saved_argv
+        metrics = archiver.RunMetrics()
+        started = time.monotonic()
+        report = archiver.archive_account(account, archive_args, metrics=metrics)
+        elapsed = time.monotonic() - started
+        # Messages that left the Inbox; a message can be moved twice on the way
+        inbox = server.state.mailboxes[archiver.FOLDERS["inbox"]]
+        return {
+            "seconds": elapsed,
+            "report": report,
+            "archived": args.messages - len(inbox.messages),
+            "round_trips": sum(server.commands.values()),
+            "commands": dict(server.commands),
+            "connections": server.state.connections,
+            "phases": metrics.summary()["phases"],
+        }
+
+
+def main():
+    args = parse_args()
+    archiver = load_archiver()
+    modes = dict(MODES)
+    for name in args.modes:
+        runs = [run_mode(archiver, args, modes[name]) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        archived = best["archived"]
+        record = {
+            "mode": name,
+            "messages": args.messages,
+            "latency_s": args.latency,
+            "status": best["report"]["status"],
+            "archived": archived,
+            "moves": best["report"]["moved"],
+            "seconds": round(best["seconds"], 3),
+            "messages_per_s": round(archived / best["seconds"], 1),
+            "round_trips": best["round_trips"],
+            "round_trips_per_message": (
+                round(best["round_trips"] / archived, 4) if archived else None
+            ),
+            "connections": best["connections"],
+            "commands": best["commands"],
+            "phases": best["phases"],
+        }
+        print(json.dumps(record), flush=True)
+
+
+if __name__ == "__main__":
+    main()
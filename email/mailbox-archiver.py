@@ -4,20 +4,49 @@
 Program     : mailbox-archiver.py
 Version     : v1.0-STABLE-2026-01-30
 Description : IMAP Email Archiving and Old Folder Deletion Script
-Syntax      : python3 mailbox-archiver.py (--dry-run)
+Syntax      : python3 mailbox-archiver.py (--dry-run) (--verbose) (--batch-size N)
+              (--connections N) (--config accounts.yaml) (--account-concurrency N)
+              (--report FILE)
+              (--state-file FILE) (--date-source header|sent|internal)
+              (--log-level LEVEL) (--progress-interval S) (--timings FILE)
+              (--export-dir DIR) (--export-format mbox|maildir)
 Author      : Andrew (andrew@devnull.uk)
 --------------------------------------------------------------------------
 """
 
 import argparse
+import contextvars
 import email
+import gzip
 import imaplib
+import json
+import logging
+import logging.handlers
+import mailbox
+import os
+import queue
 import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
 
 import dateutil.parser
 
+try:
+    import yaml
+except ImportError:
+    yaml = None  # YAML account configs need PyYAML; JSON works without it
+
+log = logging.getLogger("mailbox-archiver")
+# Account being archived with --config, shown in its log lines and folder counts
+CURRENT_ACCOUNT = contextvars.ContextVar("current_account", default=None)
+
 VERSION = "v1.0-STABLE"
 IMAP_SERVER = ""
 IMAP_PORT = 993
@@ -34,6 +63,25 @@ FORCE_DELIMITER = "."
 MAX_VALID_YEAR = datetime.now().year
 MAX_KEEP_YEARS = 30
 DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR = MAX_VALID_YEAR - MAX_KEEP_YEARS
+ARCHIVE_INBOX_AFTER_DAYS = 365  # Rule 1: Inbox -> Archive
+SPLIT_ARCHIVE_AFTER_DAYS = 730  # Rule 2: Archive -> yearly subfolders
+ACCOUNT_CONCURRENCY = 4  # Accounts processed at once with --config
+STATE_LOCK = threading.Lock()  # Guards the shared --state-file checkpoints
+STATE_SAVE_INTERVAL = 30  # Seconds between state file saves while fetching a folder
+# Server-side SEARCH keys per --date-source; "header" parses Date headers locally
+DATE_SEARCH_KEYS = {"sent": ("SENTSINCE", "SENTBEFORE"), "internal": ("SINCE", "BEFORE")}
+MIN_SEARCH_YEAR = 1970  # Oldest year bucket searched server-side
+LOG_BUFFER_RECORDS = 500  # Log records buffered per write; errors flush at once
+PROGRESS_INTERVAL = 10  # Seconds between progress lines (--progress-interval)
+PHASES = ("connect", "search", "fetch", "move", "expunge", "export", "delete")
+EXPORT_FORMATS = ("mbox", "maildir")  # mbox is written gzip-compressed
+EXPORT_BATCH_BYTES = 16 * 1024 * 1024  # Message bytes per UID FETCH while exporting
+MBOX_FROM_LINE = re.compile(rb"^>*From ", re.M)  # Body lines mboxrd quotes with ">"
+# Date header value, including folded continuation lines
+DATE_HEADER = re.compile(rb"^Date:[ \t]*([^\r\n]*(?:\r?\n[ \t][^\r\n]*)*)", re.I | re.M)
+FETCH_BATCH_SIZE = 500  # Messages per UID FETCH round trip
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (DATE SUBJECT FROM)]"
+MAX_CONNECTIONS = 8  # Upper limit for --connections; most servers cap sessions per user
 
 
 def parse_args():
@@ -42,39 +90,426 @@ def parse_args():
     parser.add_argument(
         "--dry-run", action="store_true", help="Print actions without executing them."
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Log Subject and From for every message checked (implies --log-level DEBUG).",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+        help="Lowest level of log messages written (default: INFO).",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=PROGRESS_INTERVAL,
+        help=f"Seconds between progress lines, 0 to disable (default: {PROGRESS_INTERVAL}).",
+    )
+    parser.add_argument(
+        "--timings", help="Write per-phase timings and message counts as JSON to this file."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=FETCH_BATCH_SIZE,
+        help=f"Messages per UID FETCH request (default: {FETCH_BATCH_SIZE}).",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help=f"Parallel IMAP connections, up to {MAX_CONNECTIONS} (default: 1).",
+    )
+    parser.add_argument(
+        "--config",
+        help="YAML or JSON file listing accounts to archive in one run.",
+    )
+    parser.add_argument(
+        "--account-concurrency",
+        type=int,
+        default=ACCOUNT_CONCURRENCY,
+        help=f"Accounts processed at once with --config (default: {ACCOUNT_CONCURRENCY}).",
+    )
+    parser.add_argument(
+        "--report", help="Write the per-account report as JSON to this file."
+    )
+    parser.add_argument(
+        "--date-source",
+        choices=["header"] + list(DATE_SEARCH_KEYS),
+        default="header",
+        help="How messages are dated: parse Date headers locally (header), or search "
+        "server-side by Date header (sent) or arrival time (internal), parsing only "
+        "the messages those searches miss (default: header).",
+    )
+    parser.add_argument(
+        "--export-dir",
+        help="Export old archive folders here before deleting them; a folder "
+        "whose export fails is kept.",
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=EXPORT_FORMATS,
+        default="mbox",
+        help="Export as gzip-compressed mbox or as a Maildir (default: mbox).",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="JSON file of per-folder checkpoints; cached dates are not fetched again.",
+    )
+    args = parser.parse_args()
+    if args.verbose:
+        args.log_level = "DEBUG"
+    args.verbose = args.log_level == "DEBUG"
+    if args.account_concurrency < 1:
+        parser.error("--account-concurrency must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if not 1 <= args.connections <= MAX_CONNECTIONS:
+        parser.error(f"--connections must be between 1 and {MAX_CONNECTIONS}")
+    return args
+
+
+class RunMetrics:
+    """Thread-safe per-folder message counts and per-phase timings for a run.
+
+    Folders are counted as <account>/<folder> while CURRENT_ACCOUNT is set,
+    so accounts archived together keep separate counts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.phases = {phase: {"seconds": 0.0, "calls": 0} for phase in PHASES}
+        self.folders = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the with block to the named phase."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name]["seconds"] += time.monotonic() - started
+                self.phases[name]["calls"] += 1
+
+    def count(self, folder, key, n):
+        """Add n to a folder's found, checked or moved count."""
+        account = CURRENT_ACCOUNT.get()
+        if account:
+            folder = f"{account}/{folder}"
+        with self.lock:
+            counts = self.folders.setdefault(
+                folder, {"found": 0, "checked": 0, "moved": 0}
+            )
+            counts[key] += n
+
+    def totals(self):
+        """Return found, checked and moved counts summed over folders."""
+        with self.lock:
+            return {
+                key: sum(counts[key] for counts in self.folders.values())
+                for key in ("found", "checked", "moved")
+            }
+
+    def progress_line(self):
+        """Describe progress so far: rate, ETA for the messages found, per-folder counts."""
+        totals = self.totals()
+        elapsed = time.monotonic() - self.started
+        rate = totals["checked"] / elapsed if elapsed else 0.0
+        remaining = totals["found"] - totals["checked"]
+        eta = f"{remaining / rate:.0f}s" if rate else "unknown"
+        with self.lock:
+            folders = ", ".join(
+                f"{folder} {counts['checked']}/{counts['found']} moved {counts['moved']}"
+                for folder, counts in self.folders.items()
+            )
+        return (
+            f"Progress: {totals['checked']}/{totals['found']} messages checked, "
+            f"{totals['moved']} moved, {rate:.1f} msg/s, ETA {eta}"
+            + (f" ({folders})" if folders else "")
+        )
+
+    def summary(self):
+        """Return the timings and counts as a JSON-serialisable dict.
+
+        Phase times are summed over accounts processed concurrently, so
+        they can add up to more than the elapsed time.
+        """
+        with self.lock:
+            return {
+                "seconds": round(time.monotonic() - self.started, 3),
+                "phases": {
+                    name: {"seconds": round(p["seconds"], 3), "calls": p["calls"]}
+                    for name, p in self.phases.items()
+                },
+                "folders": {folder: dict(c) for folder, c in self.folders.items()},
+            }
+
+
+class BufferedStreamHandler(logging.handlers.MemoryHandler):
+    """Buffer records and write them to a stream in one write per flush.
+
+    A MemoryHandler with a StreamHandler target still writes and flushes
+    once per record; this formats the whole buffer and writes it at once.
+    """
+
+    def __init__(self, stream, capacity, flushLevel=logging.ERROR):
+        super().__init__(capacity, flushLevel=flushLevel)
+        self.stream = stream
+
+    def flush(self):
+        """Write the buffered records with a single write() and flush()."""
+        with self.lock:
+            if not self.buffer:
+                return
+            try:
+                self.stream.write(
+                    "".join(f"{self.format(record)}\n" for record in self.buffer)
+                )
+                self.stream.flush()
+            except Exception:
+                self.handleError(self.buffer[0])
+            finally:
+                self.buffer.clear()
+
+
+def setup_logging(level):
+    """Log to stdout in writes of up to LOG_BUFFER_RECORDS records.
+
+    Errors flush the buffer immediately, and records logged while an account
+    is archived are prefixed with its name. Returns the buffering handler so
+    callers can flush it, e.g. alongside progress lines.
+    """
+
+    def add_account(record):
+        # Runs in the logging thread, before the record is buffered
+        account = CURRENT_ACCOUNT.get()
+        record.account = f"[{account}] " if account else ""
+        return True
+
+    buffer = BufferedStreamHandler(sys.stdout, LOG_BUFFER_RECORDS)
+    buffer.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(account)s%(message)s")
+    )
+    buffer.addFilter(add_account)
+    log.addHandler(buffer)
+    log.setLevel(level)
+    log.propagate = False
+    return buffer
+
+
+def report_progress(metrics, handler, interval, stop):
+    """Log a progress line every interval seconds until stop is set."""
+    while not stop.wait(interval):
+        log.info(metrics.progress_line())
+        handler.flush()
+
+
+def compress_uids(uids):
+    """Compress UIDs into an IMAP message set, e.g. 1:5,7,9:12."""
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+    start = previous = numbers[0]
+    for number in numbers[1:] + [None]:
+        if number is not None and number == previous + 1:
+            previous = number
+            continue
+        ranges.append(f"{start}:{previous}" if previous != start else f"{start}")
+        start = previous = number
+    return ",".join(ranges)
+
+
+def uid_batches(uids, batch_size):
+    """Split UIDs into lists of at most batch_size."""
+    for i in range(0, len(uids), batch_size):
+        yield uids[i : i + batch_size]
 
 
-def connect_imap(dry_run=False):
-    """Connect to IMAP server."""
+def parse_fetch_response(data):
+    """Yield (uid, literal) pairs from a UID FETCH response with one literal per message."""
+    for item in data:
+        if not isinstance(item, tuple):
+            continue
+        match = re.search(rb"UID (\d+)", item[0])
+        if match:
+            yield match.group(1), item[1]
+
+
+def default_account():
+    """Return the account settings given by the module constants."""
+    return {
+        "name": IMAP_USERNAME or IMAP_SERVER,
+        "server": IMAP_SERVER,
+        "port": IMAP_PORT,
+        "username": IMAP_USERNAME,
+        "password": IMAP_PASSWORD,
+        "ssl": USE_SSL,
+        "folders": dict(FOLDERS),
+        "delimiter": FORCE_DELIMITER,
+        "inbox_days": ARCHIVE_INBOX_AFTER_DAYS,
+        "archive_days": SPLIT_ARCHIVE_AFTER_DAYS,
+        "delete_before_year": DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR,
+    }
+
+
+def load_accounts(path):
+    """Load accounts from a YAML or JSON config file.
+
+    The file holds a list of accounts, or a mapping with an "accounts" list
+    and optional "defaults" applied to each account. Any setting left out
+    falls back to default_account(); "password_env" names an environment
+    variable to read the password from.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("PyYAML is required for YAML config files")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    if isinstance(config, list):
+        config = {"accounts": config}
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must hold a list of accounts or a mapping")
+    defaults = config.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        raise ValueError(f"defaults in {path} must be a mapping")
+    entries = config.get("accounts") or []
+    if not isinstance(entries, list):
+        raise ValueError(f"accounts in {path} must be a list")
+    accounts = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Account {i + 1} in {path} must be a mapping")
+        for source in (defaults, entry):
+            if not isinstance(source.get("folders") or {}, dict):
+                raise ValueError(f"folders for account {i + 1} in {path} must be a mapping")
+        account = default_account()
+        account.update(defaults)
+        account.update(entry)
+        account["folders"] = {
+            **FOLDERS,
+            **(defaults.get("folders") or {}),
+            **(entry.get("folders") or {}),
+        }
+        if account.get("password_env"):
+            account["password"] = os.environ.get(account["password_env"], "")
+        if not account["server"] or not account["username"]:
+            raise ValueError(f"Account {i + 1} in {path} needs a server and username")
+        account["name"] = entry.get("name") or account["username"]
+        accounts.append(account)
+    if not accounts:
+        raise ValueError(f"No accounts found in {path}")
+    return accounts
+
+
+def load_state(path):
+    """Load checkpoints from the state file, or start empty if it doesn't exist."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable state file {path}: {e}")
+        return {}
+
+
+def save_state(path, state):
+    """Write the state file atomically. Call with STATE_LOCK held."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def folder_checkpoint(state, folder, uidvalidity, uids):
+    """Return the folder's checkpoint, starting over if UIDVALIDITY changed.
+
+    A checkpoint holds the folder's UIDVALIDITY, the highest UID whose date
+    was fetched and the parsed dates (ISO string, or None when invalid) by
+    UID. Dates for UIDs no longer in uids are dropped, since those messages
+    have been moved or deleted. Call with STATE_LOCK held.
+    """
+    checkpoint = state.get(folder)
+    if checkpoint and checkpoint.get("uidvalidity") != uidvalidity:
+        log.warning(f"UIDVALIDITY changed for {folder}; discarding its checkpoint")
+        checkpoint = None
+    if not checkpoint:
+        checkpoint = {"uidvalidity": uidvalidity, "last_uid": 0, "dates": {}}
+        state[folder] = checkpoint
+    current = {uid.decode() for uid in uids}
+    checkpoint["dates"] = {
+        uid: date for uid, date in checkpoint["dates"].items() if uid in current
+    }
+    return checkpoint
+
+
+def connect_imap(account, dry_run=False):
+    """Connect to the account's IMAP server."""
     if dry_run:
-        print("Dry run: Would connect to IMAP server.")
+        log.info("Dry run: Would connect to IMAP server.")
         return None
     try:
         imap = (
-            imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-            if USE_SSL
-            else imaplib.IMAP4(IMAP_SERVER, IMAP_PORT)
+            imaplib.IMAP4_SSL(account["server"], account["port"])
+            if account["ssl"]
+            else imaplib.IMAP4(account["server"], account["port"])
         )
-        imap.login(IMAP_USERNAME, IMAP_PASSWORD)
+        imap.login(account["username"], account["password"])
         return imap
     except Exception as e:
-        print(f"Connection failed: {e}")
-        exit(1)
+        log.error(f"Connection failed for {account['name']}: {e}")
+        raise
+
+
+def run_parallel(connections, folder, func, items):
+    """Call func(imap, item) for each item, spread over the connections.
+
+    Each connection selects folder before its first call, except the first
+    connection, which the caller has already selected. Returns the results
+    in item order.
+    """
+    if len(connections) == 1:
+        return [func(connections[0], item) for item in items]
+    idle = queue.Queue()
+    for imap in connections:
+        idle.put(imap)
+    selected = {id(connections[0])}
+    account = CURRENT_ACCOUNT.get()
+
+    def task(item):
+        CURRENT_ACCOUNT.set(account)
+        imap = idle.get()
+        try:
+            if id(imap) not in selected:
+                result = imap.select(folder)
+                if result[0] != "OK":
+                    raise imaplib.IMAP4.error(f"Failed to select folder {folder}: {result[1]}")
+                selected.add(id(imap))
+            return func(imap, item)
+        finally:
+            idle.put(imap)
+
+    with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+        return list(executor.map(task, items))
 
 
 def list_folders(imap):
     """List available folders and return folders with delimiter."""
     if not imap:
-        print("Dry run: Would list available folders.")
+        log.info("Dry run: Would list available folders.")
         return [("INBOX", "."), ("Archive", "."), ("Sent", ".")]  # Mock for dry run
     try:
         result, data = imap.list()
         if result != "OK":
-            print(f"Failed to list folders: {data}")
+            log.error(f"Failed to list folders: {data}")
             return []
         folders = []
-        print("Available folders:")
+        log.info("Available folders:")
         for folder in data:
             if not folder:
                 continue
@@ -83,310 +518,803 @@ def list_folders(imap):
             if match:
                 flags, delimiter, folder_name = match.groups()
                 folder_name = folder_name.strip('"')
-                print(
+                log.debug(
                     f" - {folder_name} (Delimiter: '{delimiter or 'None'}', Flags: {flags})"
                 )
                 folders.append((folder_name, delimiter or "."))
             else:
-                print(f" - Unparseable folder entry: {folder_str}")
+                log.warning(f" - Unparseable folder entry: {folder_str}")
         return folders
     except Exception as e:
-        print(f"Error listing folders: {e}")
+        log.error(f"Error listing folders: {e}")
         return []
 
 
-def create_folder(imap, folder_name, delimiter, dry_run=False):
-    """Create folder if it doesn't exist."""
+def create_folder(imap, folder_name, delimiter, existing, dry_run=False):
+    """Create folder if it isn't in the existing set of folder names, updating the set."""
     if dry_run:
-        print(f"Dry run: Would create folder: {folder_name}")
+        log.info(f"Dry run: Would create folder: {folder_name}")
         return True
     try:
-        result, data = imap.list()
-        folder_exists = any(folder_name.encode("utf-8") in f for f in data)
-        if not folder_exists:
+        if folder_name not in existing:
             result = imap.create(folder_name)
             if result[0] == "OK":
-                print(f"Created folder: {folder_name}")
+                log.info(f"Created folder: {folder_name}")
+                existing.add(folder_name)
             else:
-                print(f"Failed to create folder: {folder_name}: {result[1]}")
+                log.error(f"Failed to create folder: {folder_name}: {result[1]}")
                 # Try without trailing slash if it fails
                 if "/" in folder_name and "Invalid mailbox name" in str(result[1]):
                     fallback_folder = folder_name.rstrip("/")
-                    print(f"Retrying without trailing slash: {fallback_folder}")
+                    log.info(f"Retrying without trailing slash: {fallback_folder}")
                     result = imap.create(fallback_folder)
                     if result[0] == "OK":
-                        print(f"Created fallback folder: {fallback_folder}")
+                        log.info(f"Created fallback folder: {fallback_folder}")
+                        existing.add(fallback_folder)
                         return True
-                    print(
+                    log.error(
                         f"Failed to create fallback folder: {fallback_folder}: {result[1]}"
                     )
                     return False
         return True
     except Exception as e:
-        print(f"Error creating folder {folder_name}: {e}")
+        log.error(f"Error creating folder {folder_name}: {e}")
         return False
 
 
-def get_email_date(imap, msg_id, folder, dry_run=False):
-    """Fetch email date and subject, handling non-UTF-8 headers."""
-    if dry_run:
-        print(f"Dry run: Would fetch date for message {msg_id} in {folder}")
-        return datetime.now() - timedelta(days=730)  # Mock date for dry run
-    try:
-        imap.select(folder)
-        result, data = imap.fetch(msg_id, "(RFC822.HEADER)")
-        if result != "OK":
-            print(f"Failed to fetch headers for message {msg_id} in {folder}")
-            return None
-        try:
-            msg = email.message_from_bytes(data[0][1])
-        except UnicodeDecodeError as e:
-            print(f"Unicode decode error for message {msg_id} in {folder}: {e}")
-            print(f"Raw headers: {data[0][1]}")
-            return None
-        date_str = msg.get("Date")
-        subject = msg.get("Subject", "")
-        sender = msg.get("From", "")
-        # Decode headers with fallback to latin1
+def fetch_email_dates(
+    imap, uids, folder, batch_size=FETCH_BATCH_SIZE, verbose=False
+):
+    """Fetch dates for UIDs in the selected folder, one UID FETCH per batch.
+
+    Returns a dict of UID to datetime, or None where the date is missing or invalid.
+    """
+    dates = {}
+    for batch in uid_batches(uids, batch_size):
         try:
-            subject_decoded = decode_header(subject)[0][0]
-            subject = (
-                subject_decoded.decode()
-                if isinstance(subject_decoded, bytes)
-                else subject_decoded or "No Subject"
-            )
-        except (UnicodeDecodeError, TypeError) as e:
-            print(f"Failed to decode Subject for message {msg_id}: {e}")
-            subject = (
-                subject.decode("latin1", errors="ignore")
-                if isinstance(subject, bytes)
-                else subject
-            )
+            result, data = imap.uid("FETCH", compress_uids(batch), f"({HEADER_FIELDS})")
+        except Exception as e:
+            log.error(f"Error fetching headers for {len(batch)} messages in {folder}: {e}")
+            continue
+        if result != "OK":
+            log.error(f"Failed to fetch headers for {len(batch)} messages in {folder}: {data}")
+            continue
+        for uid, header in parse_fetch_response(data):
+            dates[uid] = parse_email_date(header, uid, verbose)
+    return dates
+
+
+def parse_date(date_str):
+    """Parse a Date header value into a naive datetime in the sender's local time.
+
+    Tries the RFC 2822 parser first, then ISO 8601, and only then the much
+    slower general-purpose dateutil parser.
+    """
+    try:
+        parsed_date = parsedate_to_datetime(date_str)
+    except (TypeError, ValueError):
         try:
-            sender_decoded = decode_header(sender)[0][0]
-            sender = (
-                sender_decoded.decode()
-                if isinstance(sender_decoded, bytes)
-                else sender_decoded or "No Sender"
-            )
-        except (UnicodeDecodeError, TypeError) as e:
-            print(f"Failed to decode From for message {msg_id}: {e}")
-            sender = (
-                sender.decode("latin1", errors="ignore")
-                if isinstance(sender, bytes)
-                else sender
-            )
+            parsed_date = datetime.fromisoformat(date_str)
+        except ValueError:
+            parsed_date = dateutil.parser.parse(date_str)
+    return parsed_date.replace(tzinfo=None)
+
+
+def describe_email(header, msg_id):
+    """Decode Subject and From from raw header bytes, for verbose output."""
+    try:
+        msg = email.message_from_bytes(header)
+    except UnicodeDecodeError as e:
+        log.warning(f"Unicode decode error for message {msg_id}: {e}")
+        log.debug(f"Raw headers: {header}")
+        return ""
+    subject = msg.get("Subject", "")
+    sender = msg.get("From", "")
+    # Decode headers with fallback to latin1
+    try:
+        subject_decoded = decode_header(subject)[0][0]
+        subject = (
+            subject_decoded.decode()
+            if isinstance(subject_decoded, bytes)
+            else subject_decoded or "No Subject"
+        )
+    except (UnicodeDecodeError, TypeError) as e:
+        log.warning(f"Failed to decode Subject for message {msg_id}: {e}")
+        subject = (
+            subject.decode("latin1", errors="ignore")
+            if isinstance(subject, bytes)
+            else subject
+        )
+    try:
+        sender_decoded = decode_header(sender)[0][0]
+        sender = (
+            sender_decoded.decode()
+            if isinstance(sender_decoded, bytes)
+            else sender_decoded or "No Sender"
+        )
+    except (UnicodeDecodeError, TypeError) as e:
+        log.warning(f"Failed to decode From for message {msg_id}: {e}")
+        sender = (
+            sender.decode("latin1", errors="ignore")
+            if isinstance(sender, bytes)
+            else sender
+        )
+    return f", subject: {subject}, sender: {sender}"
+
+
+def parse_email_date(header, msg_id, verbose=False):
+    """Parse the date from raw header bytes without building a message object.
+
+    Only the Date header is extracted; Subject and From are decoded for the
+    messages printed when verbose is set.
+    """
+    try:
+        details = describe_email(header, msg_id) if verbose else ""
+        match = DATE_HEADER.search(header)
+        date_str = match and " ".join(match.group(1).decode("latin1").split())
         if not date_str:
-            print(
-                f"No date header for message {msg_id}, subject: {subject}, sender: {sender}"
-            )
+            log.warning(f"No date header for message {msg_id}{details}")
             return None
         try:
-            parsed_date = dateutil.parser.parse(date_str).replace(tzinfo=None)
-            print(
-                f"Message {msg_id} date: {date_str}, subject: {subject}, sender: {sender}"
-            )
+            parsed_date = parse_date(date_str)
+            if verbose:
+                log.debug(f"Message {msg_id} date: {date_str}{details}")
             if parsed_date.year > MAX_VALID_YEAR:
-                print(f"Invalid year {parsed_date.year} for message {msg_id}")
+                log.warning(f"Invalid year {parsed_date.year} for message {msg_id}")
                 return None
             return parsed_date
         except Exception as e:
-            print(
-                f"Failed to parse date for message {msg_id}, subject: {subject}, sender: {sender}: {e}"
-            )
+            log.warning(f"Failed to parse date for message {msg_id}{details}: {e}")
             return None
     except Exception as e:
-        print(f"Error fetching date for message {msg_id} in {folder}: {e}")
+        log.warning(f"Error parsing date for message {msg_id}: {e}")
         return None
 
 
-def move_emails(imap, folder, search_criteria, destination, delimiter, dry_run=False):
-    """Move emails matching criteria to destination folder."""
+def move_emails(
+    imap,
+    folder,
+    search_criteria,
+    destination,
+    delimiter,
+    existing,
+    dry_run=False,
+    batch_size=FETCH_BATCH_SIZE,
+    connections=None,
+    folders=None,
+    state=None,
+    save=None,
+    date_source="header",
+    verbose=False,
+    metrics=None,
+):
+    """Move emails matching criteria to destination folder.
+
+    Header fetches and transfers are spread over connections (default: just
+    imap), each working on its own UID batches. With a date_source other than
+    header, messages are dated by server-side searches first and only the rest
+    have their headers fetched. With a state dict, dates are
+    taken from the folder's checkpoint where cached, and fetched ones are
+    recorded in it until the message is moved out. The state is saved once
+    the folder is done, and every STATE_SAVE_INTERVAL seconds while
+    fetching. Counts and phase timings go to metrics. Returns the number of
+    messages moved.
+    """
+    metrics = metrics or RunMetrics()
+    folders = folders or FOLDERS
     if dry_run:
-        print(f"Dry run: Would select folder {folder} and search for {search_criteria}")
-        print(f"Dry run: Would process mock emails in {folder}")
+        log.info(f"Dry run: Would select folder {folder} and search for {search_criteria}")
+        log.info(f"Dry run: Would process mock emails in {folder}")
         mock_date = datetime.now() - timedelta(days=730)
         mock_year = mock_date.year
         mock_dest = (
-            f"{FOLDERS['base_archive_path']}{delimiter}{mock_year}"
-            if folder == FOLDERS["archive"]
+            f"{folders['base_archive_path']}{delimiter}{mock_year}"
+            if folder == folders["archive"]
             else destination
         )
-        print(f"Dry run: Would move mock message from {folder} to {mock_dest}")
-        return
+        log.info(f"Dry run: Would move mock message from {folder} to {mock_dest}")
+        return 0
     try:
         result = imap.select(folder)
         if result[0] != "OK":
-            print(f"Failed to select folder {folder}: {result[1]}")
-            return
-        result, data = imap.search(None, search_criteria)
+            log.error(f"Failed to select folder {folder}: {result[1]}")
+            return 0
+        with metrics.phase("search"):
+            result, data = imap.uid("SEARCH", None, search_criteria)
         if result != "OK":
-            print(f"Search failed in {folder}: {result[1]}")
-            return
+            log.error(f"Search failed in {folder}: {data}")
+            return 0
         msg_ids = data[0].split()
         if not msg_ids:
-            print(f"No emails found in {folder} for {search_criteria}")
-            return
+            log.info(f"No emails found in {folder} for {search_criteria}")
+            if state is not None:
+                with STATE_LOCK:
+                    # Cached messages would still match, so all have left
+                    if state.get(folder, {}).get("dates"):
+                        state[folder]["dates"] = {}
+                        save()
+            return 0
+        metrics.count(folder, "found", len(msg_ids))
+
+        # Years placed by server-side search, then parsed dates for the rest
+        placed = {}
+        if date_source != "header":
+            with metrics.phase("search"):
+                placed = search_years(
+                    imap,
+                    search_criteria,
+                    msg_ids,
+                    date_source,
+                    folder == folders["archive"],
+                )
+            metrics.count(folder, "checked", len(placed))
+            log.info(
+                f"Dated {len(placed)} of {len(msg_ids)} messages in {folder} by {date_source} date search"
+            )
+        unplaced = [msg_id for msg_id in msg_ids if msg_id not in placed]
 
+        dates = {}
+        checkpoint = None
+        if unplaced and state is not None:
+            uidvalidity = int(imap.response("UIDVALIDITY")[1][-1])
+            with STATE_LOCK:
+                checkpoint = folder_checkpoint(state, folder, uidvalidity, msg_ids)
+                for msg_id in unplaced:
+                    if msg_id.decode() in checkpoint["dates"]:
+                        cached = checkpoint["dates"][msg_id.decode()]
+                        dates[msg_id] = cached and datetime.fromisoformat(cached)
+            if dates:
+                log.info(f"Using cached dates for {len(dates)} messages in {folder}")
+                metrics.count(folder, "checked", len(dates))
+
+        saved_at = time.monotonic()
+
+        def fetch_batch(conn, batch):
+            nonlocal saved_at
+            batch_dates = fetch_email_dates(conn, batch, folder, batch_size, verbose)
+            metrics.count(folder, "checked", len(batch))
+            if checkpoint is not None:
+                with STATE_LOCK:
+                    for msg_id, email_date in batch_dates.items():
+                        checkpoint["dates"][msg_id.decode()] = (
+                            email_date and email_date.isoformat()
+                        )
+                    checkpoint["last_uid"] = max(
+                        [checkpoint["last_uid"]] + [int(msg_id) for msg_id in batch_dates]
+                    )
+                    if time.monotonic() - saved_at >= STATE_SAVE_INTERVAL:
+                        save()
+                        saved_at = time.monotonic()
+            return batch_dates
+
+        connections = connections or [imap]
+        with metrics.phase("fetch"):
+            for batch_dates in run_parallel(
+                connections,
+                folder,
+                fetch_batch,
+                list(uid_batches([m for m in unplaced if m not in dates], batch_size)),
+            ):
+                dates.update(batch_dates)
+        # Group by destination so each folder gets one bulk transfer
+        groups = {}
         for msg_id in msg_ids:
-            email_date = get_email_date(imap, msg_id, folder, dry_run)
-            if not email_date:
+            if msg_id in placed:
+                year = placed[msg_id]
+            elif dates.get(msg_id):
+                year = dates[msg_id].year
+            else:
                 continue
-            if folder == FOLDERS["archive"]:
-                year = email_date.year
-                dest_folder = f"{FOLDERS['base_archive_path']}{delimiter}{year}"
-                if not create_folder(imap, dest_folder, delimiter, dry_run):
-                    fallback_folder = f"{FOLDERS['base_archive_path']}{delimiter}{year}"
-                    if not create_folder(imap, fallback_folder, delimiter, dry_run):
-                        print(
-                            f"Skipping move for message {msg_id} due to folder creation failure"
-                        )
-                        continue
-                    dest_folder = fallback_folder
+            if folder == folders["archive"]:
+                dest_folder = f"{folders['base_archive_path']}{delimiter}{year}"
             else:
                 dest_folder = destination
-            if dry_run:
-                print(
-                    f"Dry run: Would move message {msg_id} from {folder} to {dest_folder}"
-                )
-                print(f"Dry run: Would mark message {msg_id} for deletion")
-                continue
-            result = imap.copy(msg_id, dest_folder)
+            groups.setdefault(dest_folder, []).append(msg_id)
+
+        use_move = supports_move(imap)
+        with metrics.phase("move"):
+            transfers = []
+            for dest_folder, uids in groups.items():
+                if folder == folders["archive"] and not create_folder(
+                    imap, dest_folder, delimiter, existing, dry_run
+                ):
+                    log.warning(
+                        f"Skipping move for {len(uids)} messages to {dest_folder} due to folder creation failure"
+                    )
+                    continue
+                transfers += [
+                    (dest_folder, batch) for batch in uid_batches(uids, batch_size)
+                ]
+            moved = run_parallel(
+                connections,
+                folder,
+                lambda conn, transfer: transfer_emails(
+                    conn, transfer[1], transfer[0], use_move, batch_size
+                ),
+                transfers,
+            )
+        metrics.count(folder, "moved", sum(moved))
+        totals = {}
+        for (dest_folder, batch), count in zip(transfers, moved):
+            totals.setdefault(dest_folder, [0, 0])
+            totals[dest_folder][0] += count
+            totals[dest_folder][1] += len(batch)
+        for dest_folder, (count, total) in totals.items():
+            log.info(f"Moved {count} of {total} messages from {folder} to {dest_folder}")
+        if not use_move:
+            with metrics.phase("expunge"):
+                imap.expunge()
+        if checkpoint is not None:
+            with STATE_LOCK:
+                # Only messages left in the folder need their dates kept
+                for (dest_folder, batch), count in zip(transfers, moved):
+                    if count == len(batch):
+                        for msg_id in batch:
+                            checkpoint["dates"].pop(msg_id.decode(), None)
+                save()
+        return sum(moved)
+    except Exception as e:
+        log.error(f"Error in move_emails for {folder}: {e}")
+        return 0
+
+
+def search_uids(imap, criteria):
+    """Return the UIDs matching criteria in the selected folder."""
+    result, data = imap.uid("SEARCH", None, criteria)
+    if result != "OK":
+        raise imaplib.IMAP4.error(f"Search failed for {criteria}: {data}")
+    return data[0].split()
+
+
+def search_years(imap, search_criteria, msg_ids, date_source, by_year=True):
+    """Date msg_ids with server-side searches instead of fetching headers.
+
+    With by_year, walks back a year at a time from MAX_VALID_YEAR, searching
+    search_criteria within each year by Date header (sent) or INTERNALDATE
+    (internal), until every UID is placed or nothing older is left. Otherwise
+    a single search over MIN_SEARCH_YEAR..MAX_VALID_YEAR finds the dated ones.
+    Returns a dict of UID to year (None without by_year); UIDs left out have
+    no usable date on the server and need client-side parsing.
+    """
+    since, before = DATE_SEARCH_KEYS[date_source]
+    wanted = set(msg_ids)
+    if not by_year:
+        found = search_uids(
+            imap,
+            f"{search_criteria} {since} 01-Jan-{MIN_SEARCH_YEAR} "
+            f"{before} 01-Jan-{MAX_VALID_YEAR + 1}",
+        )
+        return {uid: None for uid in found if uid in wanted}
+    years = {}
+    for year in range(MAX_VALID_YEAR, MIN_SEARCH_YEAR - 1, -1):
+        if len(years) == len(wanted):
+            break
+        found = search_uids(
+            imap, f"{search_criteria} {since} 01-Jan-{year} {before} 01-Jan-{year + 1}"
+        )
+        years.update((uid, year) for uid in found if uid in wanted)
+        # An empty year may be a gap; stop only when nothing older matches
+        if not found and not search_uids(
+            imap, f"{search_criteria} {before} 01-Jan-{year}"
+        ):
+            break
+    return years
+
+
+def supports_move(imap):
+    """Return True if the server advertises the MOVE extension (RFC 6851)."""
+    return "MOVE" in imap.capabilities
+
+
+def transfer_emails(imap, uids, dest_folder, use_move, batch_size=FETCH_BATCH_SIZE):
+    """Move UIDs to dest_folder in bulk and return how many were moved.
+
+    Uses UID MOVE where supported, otherwise UID COPY followed by a bulk
+    \\Deleted flag; the caller expunges afterwards in that case.
+    """
+    moved = 0
+    for batch in uid_batches(uids, batch_size):
+        message_set = compress_uids(batch)
+        if use_move:
+            result = imap.uid("MOVE", message_set, dest_folder)
+        else:
+            result = imap.uid("COPY", message_set, dest_folder)
             if result[0] == "OK":
-                imap.store(msg_id, "+FLAGS", "\\Deleted")
-                print(f"Moved message {msg_id} from {folder} to {dest_folder}")
-            else:
-                print(f"Failed to move message {msg_id} to {dest_folder}: {result[1]}")
-        if not dry_run:
-            imap.expunge()
+                result = imap.uid("STORE", message_set, "+FLAGS.SILENT", "(\\Deleted)")
+        if result[0] == "OK":
+            moved += len(batch)
+        else:
+            log.error(f"Failed to move {len(batch)} messages to {dest_folder}: {result[1]}")
+    return moved
+
+
+def export_batches(imap, folder, batch_size=FETCH_BATCH_SIZE):
+    """Yield lists of (uid, internaldate, flags) for the selected folder.
+
+    Message sizes are fetched first so that each list holds at most
+    EXPORT_BATCH_BYTES of messages, or a single larger message.
+    """
+    uids = search_uids(imap, "ALL")
+    batch, batch_bytes = [], 0
+    for uid_batch in uid_batches(uids, batch_size):
+        result, data = imap.uid(
+            "FETCH", compress_uids(uid_batch), "(RFC822.SIZE INTERNALDATE FLAGS)"
+        )
+        if result != "OK":
+            raise imaplib.IMAP4.error(f"Failed to fetch sizes in {folder}: {data}")
+        for item in data:
+            line = item[0] if isinstance(item, tuple) else item
+            uid = re.search(rb"UID (\d+)", line or b"")
+            if not uid:
+                continue
+            size = int(re.search(rb"RFC822\.SIZE (\d+)", line).group(1))
+            if batch and batch_bytes + size > EXPORT_BATCH_BYTES:
+                yield batch
+                batch, batch_bytes = [], 0
+            flags = re.search(rb"FLAGS \(([^)]*)\)", line)
+            batch.append(
+                (
+                    uid.group(1),
+                    imaplib.Internaldate2tuple(line),
+                    flags.group(1).decode().split() if flags else [],
+                )
+            )
+            batch_bytes += size
+    if batch:
+        yield batch
+
+
+def write_mbox_message(out, raw, internaldate):
+    """Append one message to an mboxrd file opened in binary mode."""
+    received = time.asctime(internaldate or time.gmtime())
+    data = MBOX_FROM_LINE.sub(rb">\g<0>", raw.replace(b"\r\n", b"\n"))
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    out.write(b"From MAILER-DAEMON " + received.encode() + b"\n" + data + b"\n")
+
+
+def export_folder(
+    imap, folder, export_dir, export_format="mbox", batch_size=FETCH_BATCH_SIZE
+):
+    """Stream every message in folder to export_dir and return True on success.
+
+    Messages are fetched in chunks of at most EXPORT_BATCH_BYTES and written
+    in order, either to <folder>.mbox.gz or to a <folder> Maildir. Both are
+    built under a .tmp name and only take their final name once complete,
+    replacing an earlier export of the folder.
+    """
+    name = folder.replace(os.sep, "_")
+    os.makedirs(export_dir, exist_ok=True)
+    result = imap.select(folder, readonly=True)
+    if result[0] != "OK":
+        log.error(f"Failed to select folder {folder} for export: {result[1]}")
+        return False
+    exported = 0
+    if export_format == "mbox":
+        path = os.path.join(export_dir, f"{name}.mbox.gz")
+        tmp_path = f"{path}.tmp"
+        out = gzip.open(tmp_path, "wb")
+    else:
+        path = os.path.join(export_dir, name)
+        tmp_path = f"{path}.tmp"
+        # Left over from an interrupted run
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        out = mailbox.Maildir(tmp_path, create=True)
+    try:
+        for batch in export_batches(imap, folder, batch_size):
+            meta = {uid: (internaldate, flags) for uid, internaldate, flags in batch}
+            result, data = imap.uid(
+                "FETCH", compress_uids(list(meta)), "(BODY.PEEK[])"
+            )
+            if result != "OK":
+                raise imaplib.IMAP4.error(f"Failed to fetch messages: {data}")
+            for uid, raw in parse_fetch_response(data):
+                internaldate, flags = meta.pop(uid)
+                if export_format == "mbox":
+                    write_mbox_message(out, raw, internaldate)
+                else:
+                    message = mailbox.MaildirMessage(raw)
+                    if "\\Seen" in flags:
+                        message.set_subdir("cur")
+                        message.add_flag("S")
+                    out.add(message)
+                exported += 1
+            if meta:
+                raise imaplib.IMAP4.error(f"{len(meta)} messages missing from FETCH")
     except Exception as e:
-        print(f"Error in move_emails for {folder}: {e}")
+        log.error(f"Export of {folder} failed after {exported} messages: {e}")
+        if export_format == "mbox":
+            out.close()
+            os.remove(tmp_path)
+        else:
+            shutil.rmtree(tmp_path)
+        return False
+    if export_format == "mbox":
+        out.close()
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    log.info(f"Exported {exported} messages from {folder} to {path}")
+    return True
+
 
+def delete_old_archive_folders(
+    imap,
+    year_threshold,
+    delimiter,
+    existing,
+    dry_run=False,
+    folders=None,
+    export_dir=None,
+    export_format="mbox",
+    batch_size=FETCH_BATCH_SIZE,
+    metrics=None,
+):
+    """Delete yearly archive folders older than the specified year_threshold.
 
-def delete_old_archive_folders(imap, year_threshold, delimiter, dry_run=False):
-    """Delete yearly archive folders older than the specified year_threshold."""
+    With export_dir, each folder is exported first and only deleted if the
+    export succeeded. Returns the names of the deleted folders.
+    """
+    metrics = metrics or RunMetrics()
+    deleted = []
     if dry_run:
-        print(f"Dry run: Would delete archive folders before {year_threshold}.")
-        return
+        if export_dir:
+            log.info(f"Dry run: Would export archive folders to {export_dir}.")
+        log.info(f"Dry run: Would delete archive folders before {year_threshold}.")
+        return deleted
 
     try:
-        print(f"Listing folders to find archives to delete before {year_threshold}...")
-        # Get all folders
-        result, data = imap.list()
-        if result != "OK":
-            print(f"Failed to list folders: {data}")
-            return
-
-        archive_base = FOLDERS["base_archive_path"]
+        log.info(f"Checking folders for archives to delete before {year_threshold}...")
+        archive_base = (folders or FOLDERS)["base_archive_path"]
         # Pattern to match folders like "Archive.YYYY"
         pattern = re.compile(
             rf"^{re.escape(archive_base)}{re.escape(delimiter)}(\d{{4}})\W?$"
         )
 
-        for folder_entry in data:
-            if not folder_entry:
-                continue
-            folder_str = folder_entry.decode("utf-8", errors="ignore")
-            match = re.search(r'\((.*?)\)\s*"([^"]*)"\s+(\S+)', folder_str)
-            if match:
-                flags, _, folder_name = match.groups()
-                folder_name = folder_name.strip('"')
-
-                folder_match = pattern.match(folder_name)
-                if folder_match:
-                    folder_year = int(folder_match.group(1))
-                    if folder_year < year_threshold:
-                        print(f"Found old archive folder to delete: {folder_name}")
-                        try:
-                            # Before deleting, select the folder and expunge to ensure it's empty
-                            # Some IMAP servers require folders to be empty before deletion
-                            print(
-                                f"Selecting and expunging folder '{folder_name}' before deletion..."
-                            )
+        for folder_name in sorted(existing):
+            folder_match = pattern.match(folder_name)
+            if folder_match:
+                folder_year = int(folder_match.group(1))
+                if folder_year < year_threshold:
+                    log.info(f"Found old archive folder to delete: {folder_name}")
+                    try:
+                        if export_dir:
+                            with metrics.phase("export"):
+                                exported = export_folder(
+                                    imap, folder_name, export_dir, export_format, batch_size
+                                )
+                            if not exported:
+                                log.error(f"Keeping folder {folder_name}: export failed")
+                                continue
+                        # Before deleting, select the folder and expunge to ensure it's empty
+                        # Some IMAP servers require folders to be empty before deletion
+                        log.debug(
+                            f"Selecting and expunging folder '{folder_name}' before deletion..."
+                        )
+                        with metrics.phase("delete"):
                             imap.select(folder_name)
                             imap.expunge()
                             imap.close()
 
                             result = imap.delete(folder_name)
-                            if result[0] == "OK":
-                                print(f"Deleted folder: {folder_name}")
-                            else:
-                                print(
-                                    f"Failed to delete folder {folder_name}: {result[1]}"
-                                )
-                        except Exception as e:
-                            print(f"Error deleting folder {folder_name}: {e}")
+                        if result[0] == "OK":
+                            log.info(f"Deleted folder: {folder_name}")
+                            existing.discard(folder_name)
+                            deleted.append(folder_name)
+                        else:
+                            log.error(f"Failed to delete folder {folder_name}: {result[1]}")
+                    except Exception as e:
+                        log.error(f"Error deleting folder {folder_name}: {e}")
     except Exception as e:
-        print(f"An error occurred while deleting old archive folders: {e}")
+        log.error(f"An error occurred while deleting old archive folders: {e}")
+    return deleted
 
 
-def main():
-    print(f"{VERSION} - Automate archiving and deletion tasks for IMAP folders.\n")
-    args = parse_args()
+def archive_account(account, args, states=None, metrics=None):
+    """Run the archiving rules for one account and return its report.
+
+    states holds the checkpoints of every account, keyed by username@server,
+    and is saved to args.state_file as folders are processed. Counts and
+    phase timings are added to metrics.
+    """
+    metrics = metrics or RunMetrics()
     dry_run = args.dry_run
+    folders = account["folders"]
+    state = save = None
+    if states is not None and not dry_run:
+        with STATE_LOCK:
+            state = states.setdefault(f"{account['username']}@{account['server']}", {})
 
-    # Connect IMAP
-    imap = connect_imap(dry_run)
-
-    # List IMAP folders and determine delimiter
-    folders = list_folders(imap)
-    delimiter = FORCE_DELIMITER or "/"  # Use forced delimiter for ProtonMail
-    if not FORCE_DELIMITER:
-        for folder_name, delim in folders:
-            if folder_name in [FOLDERS["inbox"], FOLDERS["archive"]]:
-                delimiter = delim
-                break
-    print(f"Using delimiter: '{delimiter}'")
-
-    # Create Archive folder if it doesn't exist
-    if not create_folder(imap, FOLDERS["archive"], delimiter, dry_run):
-        print("Cannot proceed without Archive folder")
-        if not dry_run:
-            imap.logout()
-        exit(1)
+        def save():
+            save_state(args.state_file, states)
 
-    # Calculate date thresholds
-    one_year_ago = (datetime.now() - timedelta(days=365)).strftime("%d-%b-%Y")
-    two_years_ago = (datetime.now() - timedelta(days=730)).strftime("%d-%b-%Y")
-
-    # Rule 1: Inbox -> Archive (older than 1 year)
-    print("Archiving Inbox emails older than 1 year...")
-    move_emails(
-        imap,
-        FOLDERS["inbox"],
-        f"BEFORE {one_year_ago}",
-        FOLDERS["archive"],
-        delimiter,
-        dry_run,
-    )
+    report = {"account": account["name"], "status": "ok", "moved": 0, "deleted": []}
+    started = time.monotonic()
+    connections = []
 
-    # Rule 2: Archive -> Yearly subfolders (older than 2 years)
-    print("Archiving Archive emails older than 2 years...")
-    move_emails(
-        imap, FOLDERS["archive"], f"BEFORE {two_years_ago}", None, delimiter, dry_run
-    )
+    try:
+        # Connect IMAP; the first connection also handles folder management
+        with metrics.phase("connect"):
+            imap = connect_imap(account, dry_run)
+            connections.append(imap)
+            if not dry_run and args.connections > 1:
+                with ThreadPoolExecutor(max_workers=args.connections - 1) as executor:
+                    futures = [
+                        executor.submit(connect_imap, account)
+                        for _ in range(args.connections - 1)
+                    ]
+                # Keep every session that logged in, so the cleanup below
+                # logs it out even when another connection failed
+                errors = []
+                for future in futures:
+                    try:
+                        connections.append(future.result())
+                    except Exception as e:
+                        errors.append(e)
+                if errors:
+                    raise errors[0]
 
-    # Rule 3: Check if we need to delete old archive folders
-    if DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR is not None:
-        if not isinstance(DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR, int):
-            print("Error: DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR must be an integer year.")
-        else:
-            print(
-                f"Initiating deletion of archive folders before {DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR}..."
-            )
-            delete_old_archive_folders(
-                imap, DELETE_ARCHIVE_FOLDERS_BEFORE_YEAR, delimiter, dry_run
-            )
-            print("Old folder deletion process complete.")
+        # List IMAP folders and determine delimiter
+        listed = list_folders(imap)
+        force_delimiter = account["delimiter"]
+        delimiter = force_delimiter or "/"  # Use forced delimiter for ProtonMail
+        if not force_delimiter:
+            for folder_name, delim in listed:
+                if folder_name in [folders["inbox"], folders["archive"]]:
+                    delimiter = delim
+                    break
+        log.info(f"Using delimiter: '{delimiter}'")
+        # Folder names seen on the server, kept current as folders are created or deleted
+        existing = {folder_name for folder_name, _ in listed}
+
+        # Create Archive folder if it doesn't exist
+        if not create_folder(imap, folders["archive"], delimiter, existing, dry_run):
+            raise RuntimeError("Cannot proceed without Archive folder")
+
+        # Calculate date thresholds
+        inbox_days, archive_days = account["inbox_days"], account["archive_days"]
+        inbox_before = (datetime.now() - timedelta(days=inbox_days)).strftime("%d-%b-%Y")
+        archive_before = (datetime.now() - timedelta(days=archive_days)).strftime(
+            "%d-%b-%Y"
+        )
+
+        # Rule 1: Inbox -> Archive
+        log.info(f"Archiving Inbox emails older than {inbox_days} days...")
+        report["moved"] += move_emails(
+            imap,
+            folders["inbox"],
+            f"BEFORE {inbox_before}",
+            folders["archive"],
+            delimiter,
+            existing,
+            dry_run,
+            args.batch_size,
+            connections,
+            folders,
+            state,
+            save,
+            args.date_source,
+            args.verbose,
+            metrics,
+        )
+
+        # Rule 2: Archive -> Yearly subfolders
+        log.info(f"Archiving Archive emails older than {archive_days} days...")
+        report["moved"] += move_emails(
+            imap,
+            folders["archive"],
+            f"BEFORE {archive_before}",
+            None,
+            delimiter,
+            existing,
+            dry_run,
+            args.batch_size,
+            connections,
+            folders,
+            state,
+            save,
+            args.date_source,
+            args.verbose,
+            metrics,
+        )
+
+        # Rule 3: Check if we need to delete old archive folders
+        delete_before_year = account["delete_before_year"]
+        if delete_before_year is not None:
+            if not isinstance(delete_before_year, int):
+                log.error("Error: delete_before_year must be an integer year.")
+            else:
+                log.info(
+                    f"Initiating deletion of archive folders before {delete_before_year}..."
+                )
+                export_dir = args.export_dir and os.path.join(
+                    args.export_dir, account["name"]
+                )
+                report["deleted"] = delete_old_archive_folders(
+                    imap,
+                    delete_before_year,
+                    delimiter,
+                    existing,
+                    dry_run,
+                    folders,
+                    export_dir,
+                    args.export_format,
+                    args.batch_size,
+                    metrics,
+                )
+                log.info("Old folder deletion process complete.")
+    except Exception as e:
+        log.error(f"Archiving failed for {account['name']}: {e}")
+        report["status"] = "error"
+        report["error"] = str(e)
 
     # Final Cleanup
-    if not dry_run and imap:
+    for conn in connections:
+        if conn is None:
+            continue
         try:
-            imap.close()
+            conn.close()
         except imaplib.IMAP4.error:
             # Ignore error if no folder is selected
             pass
-        imap.logout()
+        try:
+            conn.logout()
+        except Exception:
+            pass
+    report["seconds"] = round(time.monotonic() - started, 3)
+    return report
+
+
+def main():
+    args = parse_args()
+    handler = setup_logging(args.log_level)
+    log.info(f"{VERSION} - Automate archiving and deletion tasks for IMAP folders.")
+    states = load_state(args.state_file) if args.state_file else None
+    metrics = RunMetrics()
+    stop = threading.Event()
+    if args.progress_interval > 0:
+        threading.Thread(
+            target=report_progress,
+            args=(metrics, handler, args.progress_interval, stop),
+            daemon=True,
+        ).start()
+
+    if args.config:
+        try:
+            accounts = load_accounts(args.config)
+        except (OSError, ValueError) as e:
+            log.error(f"Failed to load config {args.config}: {e}")
+            logging.shutdown()
+            exit(1)
+
+        def archive(account):
+            # Tag log lines and folder counts, as accounts run side by side
+            CURRENT_ACCOUNT.set(account["name"])
+            return archive_account(account, args, states, metrics)
+
+        with ThreadPoolExecutor(max_workers=args.account_concurrency) as executor:
+            reports = list(executor.map(archive, accounts))
+        log.info("Account report:")
+        for report in reports:
+            log.info(
+                f" - {report['account']}: {report['status']}, moved {report['moved']}, "
+                f"deleted {len(report['deleted'])} folders in {report['seconds']}s"
+                + (f" ({report['error']})" if report["status"] != "ok" else "")
+            )
+    else:
+        reports = [archive_account(default_account(), args, states, metrics)]
+
+    stop.set()
+    log.info(metrics.progress_line())
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    if args.timings:
+        with open(args.timings, "w", encoding="utf-8") as f:
+            json.dump(metrics.summary(), f, indent=2)
+    logging.shutdown()
+    if any(report["status"] != "ok" for report in reports):
+        exit(1)
 
 
 if __name__ == "__main__":
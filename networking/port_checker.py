@@ -1,25 +1,526 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 # Simple Port checker.
 
+import asyncio
+import csv
+import ipaddress
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque, namedtuple
 from optparse import OptionParser, OptionGroup, OptionValueError
 from socket import *
 
-version="1.0"
+version="1.1"
 timeout=5
+minTimeout=0.25
+maxTimeout=10
+rttWindow=1000
+concurrency=256
+hostConcurrency=32
+dnsConcurrency=64
+dnsTtl=300
+flushInterval=0.5
 
-def conn(targetHost, targetPort):
+# One record per probe; state is open, closed, filtered or error.
+Result = namedtuple('Result', 'host ip port state latency error')
+
+class HostLimiter:
+    # Caps the number of probes in flight against a single host. Semaphores
+    # are created on first use and dropped once the host goes idle, so long
+    # target streams do not accumulate one entry per host ever seen.
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.sems = {}
+        self.users = {}
+
+    async def acquire(self, host):
+        if host not in self.sems:
+            self.sems[host] = asyncio.Semaphore(self.limit)
+            self.users[host] = 0
+        self.users[host] += 1
+        await self.sems[host].acquire()
+
+    def release(self, host):
+        self.sems[host].release()
+        self.users[host] -= 1
+        if not self.users[host]:
+            del self.sems[host]
+            del self.users[host]
+
+class Resolver:
+    # Resolves each unique host name once and caches the answer (or the
+    # failure) for ttl seconds. Concurrent requests for the same name share
+    # a single lookup, and lookups for different names run in parallel up
+    # to the given limit. Address literals never touch getaddrinfo.
+
+    def __init__(self, family=AF_UNSPEC, ttl=dnsTtl, limit=dnsConcurrency):
+        self.family = family
+        self.ttl = ttl
+        self.limit = limit
+        self.cache = {}
+        self.lookups = {}
+        self.sem = None
+
+    def prefetch(self, host):
+        # Start a lookup in the background if the name is not cached yet.
+        if (host not in self.lookups) and (self.cached(host) is None):
+            self.lookups[host] = asyncio.ensure_future(self.lookup(host))
+
+    def cached(self, host):
+        entry = self.cache.get(host)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.cache[host]
+            return None
+        return entry
+
+    async def resolve(self, host):
+        # Returns (family, sockaddr) for the preferred address of host.
+        entry = self.cached(host)
+        if entry is None:
+            self.prefetch(host)
+            entry = await asyncio.shield(self.lookups[host])
+        if isinstance(entry[1], Exception):
+            raise entry[1]
+        return entry[1]
+
+    async def lookup(self, host):
+        try:
+            try:
+                address = ipaddress.ip_address(host.strip('[]'))
+            except ValueError:
+                address = None
+
+            if address is not None:
+                if (self.family != AF_UNSPEC) & (self.family != (AF_INET6 if address.version == 6 else AF_INET)):
+                    answer = gaierror(EAI_FAMILY, 'Address family for hostname not supported')
+                else:
+                    answer = (AF_INET6 if address.version == 6 else AF_INET, (str(address), 0))
+                entry = (float('inf'), answer)
+            else:
+                if self.sem is None:
+                    self.sem = asyncio.Semaphore(self.limit)
+                async with self.sem:
+                    try:
+                        infos = await asyncio.get_running_loop().getaddrinfo(host, None, family=self.family, type=SOCK_STREAM)
+                        answer = (infos[0][0], infos[0][4])
+                    except (gaierror, OSError) as e:
+                        answer = e
+                entry = (time.monotonic() + self.ttl, answer)
+
+            # Literals are cheap to recompute; only names are worth keeping.
+            if address is None:
+                self.cache[host] = entry
+            return entry
+
+        finally:
+            del self.lookups[host]
+
+class RttStats:
+    # Connect latency for one address. The smoothed RTT and variance follow
+    # RFC 6298; percentiles are taken over the most recent samples only so
+    # memory stays bounded on long scans.
+
+    def __init__(self, host):
+        self.host = host
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.srtt = None
+        self.rttvar = None
+        self.window = deque(maxlen=rttWindow)
+
+    def add(self, rtt):
+        self.count += 1
+        self.total += rtt
+        self.window.append(rtt)
+        if (self.min is None) or (rtt < self.min):
+            self.min = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def avg(self):
+        return self.total / self.count
+
+    def p99(self):
+        samples = sorted(self.window)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+class RttTracker:
+    # Derives a per-address connect timeout from observed RTTs, clamped to
+    # [floor, ceiling]. Addresses with no samples yet use the initial value.
+
+    def __init__(self, initial=timeout, floor=minTimeout, ceiling=maxTimeout):
+        self.initial = initial
+        self.floor = floor
+        self.ceiling = ceiling
+        self.stats = {}
+
+    def timeout(self, ip):
+        stats = self.stats.get(ip)
+        if stats is None:
+            return min(max(self.initial, self.floor), self.ceiling)
+        return min(max(stats.srtt + 4 * stats.rttvar, self.floor), self.ceiling)
+
+    def add(self, host, ip, rtt):
+        if ip not in self.stats:
+            self.stats[ip] = RttStats(host)
+        self.stats[ip].add(rtt)
+
+def specItems(spec):
+    # Split a comma separated spec, replacing @file entries with the
+    # non-blank, non-comment lines of that file. Files may nest.
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('@'):
+            with open(item[1:]) as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        for fileItem in specItems(line):
+                            yield fileItem
+        else:
+            yield item
+
+def expandHosts(spec):
+    # Hosts may be names, addresses, CIDR blocks (10.0.0.0/16) or address
+    # ranges (10.0.0.1-10.0.0.50, or 10.0.0.1-50 for the last octet). All are
+    # generated lazily so a /8 costs no more memory than a single host.
+    for item in specItems(spec):
+        if '/' in item:
+            try:
+                network = ipaddress.ip_network(item, strict=False)
+            except ValueError:
+                raise ValueError('invalid CIDR block: ' + item)
+            if network.num_addresses == 1:
+                yield str(network.network_address)
+            else:
+                for address in network.hosts():
+                    yield str(address)
+            continue
+
+        first, sep, last = item.partition('-')
+        try:
+            first = ipaddress.ip_address(first)
+        except ValueError:
+            first = None
+
+        if (not sep) | (first is None):
+            yield item
+            continue
+
+        try:
+            if last.isdigit() and first.version == 4:
+                last = ipaddress.ip_address(str(first).rsplit('.', 1)[0] + '.' + last)
+            else:
+                last = ipaddress.ip_address(last)
+        except ValueError:
+            raise ValueError('invalid address range: ' + item)
+        if (last.version != first.version) | (last < first):
+            raise ValueError('invalid address range: ' + item)
+        for address in range(int(first), int(last) + 1):
+            yield str(type(first)(address))
+
+def portRanges(spec):
+    # Ports may be single ports or inclusive ranges (1-1024). Returned as
+    # (first, last) pairs so 1-65535 is one entry rather than 65535.
+    ranges = []
+    for item in specItems(spec):
+        first, sep, last = item.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if sep else first
+        except ValueError:
+            raise ValueError('invalid port: ' + item)
+        if not (0 < first <= last <= 65535):
+            raise ValueError('invalid port: ' + item)
+        ranges.append((first, last))
+    return ranges
+
+def expandTargets(hostSpec, portSpec, block=concurrency):
+    # Yield (host, port) pairs, taking hosts a block at a time and walking
+    # ports across the block so consecutive probes are spread over many
+    # hosts instead of queueing behind a single host's limit.
+    ranges = portRanges(portSpec)
+    hosts = expandHosts(hostSpec)
+    while True:
+        hostBlock = list(itertools.islice(hosts, block))
+        if not hostBlock:
+            break
+        for first, last in ranges:
+            for targetPort in range(first, last + 1):
+                for targetHost in hostBlock:
+                    yield (targetHost, targetPort)
+
+def classify(e):
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return 'filtered'
+    if isinstance(e, ConnectionRefusedError):
+        return 'closed'
+    return 'error'
+
+async def conn(targetHost, targetPort, resolver, rtt):
     try:
-        conn = socket(AF_INET, SOCK_STREAM)
-        conn.connect((targetHost, targetPort))
-        print ('[+] ' + str(targetPort) + ' Success'),
+        family, sockaddr = await resolver.resolve(targetHost)
+    except Exception as e:
+        return Result(targetHost, None, targetPort, 'error', None, e)
+
+    loop = asyncio.get_running_loop()
+    sock = None
+    start = time.monotonic()
+    try:
+        # Created inside the try so running out of descriptors is reported
+        # as an error result instead of ending the worker.
+        sock = socket(family, SOCK_STREAM)
+        sock.setblocking(False)
+        await asyncio.wait_for(loop.sock_connect(sock, (sockaddr[0], targetPort) + sockaddr[2:]), rtt.timeout(sockaddr[0]))
+        latency = time.monotonic() - start
+        rtt.add(targetHost, sockaddr[0], latency)
+        return Result(targetHost, sockaddr[0], targetPort, 'open', latency, None)
+
+    except Exception as e:
+        state = classify(e)
+        latency = None
+        # A refused connection is a full round trip, so it counts too.
+        if state == 'closed':
+            latency = time.monotonic() - start
+            rtt.add(targetHost, sockaddr[0], latency)
+        return Result(targetHost, sockaddr[0], targetPort, state, latency, e)
 
-    except (Exception, e):
-        print ('[-] ' + str(targetPort) + ' Failed: ' + str(e)),
+    finally:
+        if sock is not None:
+            sock.close()
+
+async def scan(targets, maxConcurrency=concurrency, maxPerHost=hostConcurrency, resolver=None, rtt=None):
+    # Feed (host, port) pairs from any iterable through a fixed pool of
+    # workers, yielding results in completion order. The queues are bounded
+    # so the target iterable is consumed only as fast as probes finish.
+    # Names are handed to the resolver as the producer first sees them, so
+    # lookups run ahead of the probes that need them.
+    pending = asyncio.Queue(maxConcurrency * 2)
+    results = asyncio.Queue(maxConcurrency * 2)
+    limiter = HostLimiter(maxPerHost)
+    if resolver is None:
+        resolver = Resolver()
+    if rtt is None:
+        rtt = RttTracker()
+
+    async def producer():
+        try:
+            for target in targets:
+                resolver.prefetch(target[0])
+                await pending.put(target)
+        finally:
+            for _ in range(maxConcurrency):
+                await pending.put(None)
+
+    async def worker():
+        try:
+            while True:
+                target = await pending.get()
+                if target is None:
+                    break
+                targetHost, targetPort = target
+                await limiter.acquire(targetHost)
+                try:
+                    await results.put(await conn(targetHost, targetPort, resolver, rtt))
+                finally:
+                    limiter.release(targetHost)
+        finally:
+            await results.put(None)
 
+    tasks = [asyncio.ensure_future(producer())]
+    tasks += [asyncio.ensure_future(worker()) for _ in range(maxConcurrency)]
+
+    try:
+        running = maxConcurrency
+        while running:
+            result = await results.get()
+            if result is None:
+                running -= 1
+                continue
+            yield result
+        await tasks[0]
     finally:
-        conn.close()
+        for task in tasks:
+            task.cancel()
+
+def ms(seconds):
+    return '%.1f ms' % (seconds * 1000)
+
+def record(result, previous=None):
+    # Flatten a result into the field order shared by the structured sinks.
+    # previous is only set for state change events in watch mode.
+    return [
+        round(time.time(), 3),
+        result.host,
+        result.ip,
+        result.port,
+        result.state,
+        None if result.latency is None else round(result.latency * 1000, 3),
+        None if result.error is None else type(result.error).__name__,
+        None if result.error is None else str(result.error),
+        previous,
+        ]
+
+recordFields = ['time', 'host', 'ip', 'port', 'state', 'latency_ms', 'error', 'message', 'previous']
+
+class TerminalSink:
+    # The original human readable [+]/[-] lines.
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, result, previous=None):
+        if previous is not None:
+            self.out.write('[*] ' + result.host + ':' + str(result.port) + ' ' + previous + ' -> ' + result.state + '\n')
+        elif result.state == 'open':
+            self.out.write('[+] ' + result.host + ':' + str(result.port) + ' Success (' + ms(result.latency) + ')\n')
+        else:
+            self.out.write('[-] ' + result.host + ':' + str(result.port) + ' Failed: ' + (str(result.error) or result.state) + '\n')
+
+    def flush(self):
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+
+class JsonSink(TerminalSink):
+    # One JSON object per line (NDJSON).
+
+    def write(self, result, previous=None):
+        self.out.write(json.dumps(dict(zip(recordFields, record(result, previous))), separators=(',', ':')) + '\n')
+
+class CsvSink(TerminalSink):
+    # CSV with a header row; empty cells for missing values.
+
+    def __init__(self, out):
+        TerminalSink.__init__(self, out)
+        self.writer = csv.writer(out)
+        self.writer.writerow(recordFields)
+
+    def write(self, result, previous=None):
+        self.writer.writerow(record(result, previous))
+
+sinkTypes = {'text': TerminalSink, 'json': JsonSink, 'csv': CsvSink}
+
+def openSink(spec):
+    # spec is format[:path]; the path defaults to - (stdout).
+    fmt, _, path = spec.partition(':')
+    if fmt not in sinkTypes:
+        raise ValueError('unknown output format: ' + fmt)
+    if path in ('', '-'):
+        return sinkTypes[fmt](sys.stdout)
+    return sinkTypes[fmt](open(path, 'w', newline=''))
+
+def summary(rtt, out):
+    out.write('\nConnect latency:\n\n')
+    for ip, stats in sorted(rtt.stats.items()):
+        out.write('    ' + stats.host + ' (' + ip + '): min ' + ms(stats.min) + ', avg ' + ms(stats.avg()) +
+                  ', p99 ' + ms(stats.p99()) + ', ' + str(stats.count) + ' samples\n')
+
+class TargetState:
+    # Last known state of one host:port in watch mode, plus availability
+    # counters since the watch started.
+    __slots__ = ('state', 'since', 'probes', 'up')
+
+    def __init__(self, state):
+        self.state = state
+        self.since = time.time()
+        self.probes = 0
+        self.up = 0
+
+    def availability(self):
+        return 100.0 * self.up / self.probes
+
+def availability(states, out):
+    out.write('\nAvailability:\n\n')
+    for (targetHost, targetPort), target in sorted(states.items()):
+        out.write('    ' + targetHost + ':' + str(targetPort) + ' ' + target.state + ', up ' + str(target.up) + '/' +
+                  str(target.probes) + ' (%.2f%%)' % target.availability() + '\n')
+
+def writeStatus(states, path):
+    # Replace the status file atomically so readers never see a partial one.
+    status = {}
+    for (targetHost, targetPort), target in states.items():
+        status[targetHost + ':' + str(targetPort)] = {
+            'state': target.state,
+            'since': round(target.since, 3),
+            'probes': target.probes,
+            'up': target.up,
+            'availability': round(target.availability(), 3),
+            }
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+async def flusher(sinks):
+    # Results are written through buffered files; push them out regularly so
+    # readers see records promptly without a flush per record.
+    while True:
+        await asyncio.sleep(flushInterval)
+        for sink in sinks:
+            sink.flush()
+
+async def watch(targets, options, sinks, resolver, rtt, states):
+    # Re-probe every interval seconds with the same resolver cache and RTT
+    # history, and only pass results to the sinks when a target's state
+    # differs from the previous round. The first round reports everything.
+    while True:
+        started = time.monotonic()
+        async for result in scan(targets(), options.concurrency, options.hostConcurrency, resolver, rtt):
+            key = (result.host, result.port)
+            target = states.get(key)
+            if target is None:
+                target = states[key] = TargetState(result.state)
+                for sink in sinks:
+                    sink.write(result)
+            elif target.state != result.state:
+                previous = target.state
+                target.state = result.state
+                target.since = time.time()
+                for sink in sinks:
+                    sink.write(result, previous)
+            target.probes += 1
+            if result.state == 'open':
+                target.up += 1
+        if options.status:
+            writeStatus(states, options.status)
+        await asyncio.sleep(max(0, options.watch - (time.monotonic() - started)))
+
+async def run(targets, options, sinks):
+    resolver = Resolver(options.family, options.dnsTtl, options.dnsConcurrency)
+    rtt = RttTracker(options.timeout, options.minTimeout, options.maxTimeout)
+    states = {}
+    task = asyncio.ensure_future(flusher(sinks))
+    try:
+        if options.watch is None:
+            async for result in scan(targets(), options.concurrency, options.hostConcurrency, resolver, rtt):
+                for sink in sinks:
+                    sink.write(result)
+        else:
+            await watch(targets, options, sinks, resolver, rtt, states)
+    finally:
+        task.cancel()
+        # Also reached when a watch is interrupted, so the summary survives ^C.
+        if options.summary:
+            out = sys.stdout if any(type(sink) is TerminalSink for sink in sinks) else sys.stderr
+            summary(rtt, out)
+            if states:
+                availability(states, out)
 
 def main():
     parser = OptionParser(usage='\n  %prog\t-t <target host(s)> -p <target port(s)>', version='%prog ' + version)
@@ -28,7 +529,7 @@ def main():
 	'-t',
 	dest='targetHosts',
 	type='string',
-	help='Specify the target host(s); Separate them by commas',
+	help='Specify the target host(s), CIDR blocks, address ranges or @file; Separate them by commas',
 	metavar='targethosts',
 	)
 
@@ -36,25 +537,182 @@ def main():
 	'-p',
 	dest='targetPorts',
 	type='string',
-	help='Specify the target port(s); Separate them by commas',
+	help='Specify the target port(s), port ranges or @file; Separate them by commas',
 	metavar='targetports'
 	)
 
+    group = OptionGroup(parser, 'Scan Options')
+
+    group.add_option(
+	'-c',
+	dest='concurrency',
+	type='int',
+	default=concurrency,
+	help='Maximum number of connections in flight [default: %default]',
+	metavar='count'
+	)
+
+    group.add_option(
+	'-n',
+	dest='hostConcurrency',
+	type='int',
+	default=hostConcurrency,
+	help='Maximum number of connections in flight per host [default: %default]',
+	metavar='count'
+	)
+
+    group.add_option(
+	'-w',
+	dest='timeout',
+	type='float',
+	default=timeout,
+	help='Connect timeout before a host has any RTT samples [default: %default]',
+	metavar='seconds'
+	)
+
+    group.add_option(
+	'--min-timeout',
+	dest='minTimeout',
+	type='float',
+	default=minTimeout,
+	help='Lower bound for adaptive connect timeouts [default: %default]',
+	metavar='seconds'
+	)
+
+    group.add_option(
+	'--max-timeout',
+	dest='maxTimeout',
+	type='float',
+	default=maxTimeout,
+	help='Upper bound for adaptive connect timeouts; set equal to --min-timeout for a fixed timeout [default: %default]',
+	metavar='seconds'
+	)
+
+    group.add_option(
+	'-s',
+	dest='summary',
+	action='store_true',
+	default=False,
+	help='Print min/avg/p99 connect latency per host, and availability per target in watch mode, after the scan'
+	)
+
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Watch Options')
+
+    group.add_option(
+	'--watch',
+	dest='watch',
+	type='float',
+	help='Keep re-probing every interval seconds and only report state changes',
+	metavar='interval'
+	)
+
+    group.add_option(
+	'--status',
+	dest='status',
+	type='string',
+	help='Rewrite per-target state and availability counters as JSON to this file after each watch round',
+	metavar='path'
+	)
+
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Output Options')
+
+    group.add_option(
+	'-o',
+	dest='outputs',
+	action='append',
+	default=[],
+	help='Write one record per probe as format[:path], format being text, json (NDJSON) or csv; may be repeated [default: text:-]',
+	metavar='format[:path]'
+	)
+
+    group.add_option(
+	'-q',
+	dest='quiet',
+	action='store_true',
+	default=False,
+	help='Do not write the default terminal output'
+	)
+
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Resolver Options')
+
+    group.add_option(
+	'-4',
+	dest='family',
+	action='store_const',
+	const=AF_INET,
+	default=AF_UNSPEC,
+	help='Only use IPv4 addresses'
+	)
+
+    group.add_option(
+	'-6',
+	dest='family',
+	action='store_const',
+	const=AF_INET6,
+	help='Only use IPv6 addresses'
+	)
+
+    group.add_option(
+	'--dns-concurrency',
+	dest='dnsConcurrency',
+	type='int',
+	default=dnsConcurrency,
+	help='Maximum number of name lookups in flight [default: %default]',
+	metavar='count'
+	)
+
+    group.add_option(
+	'--dns-ttl',
+	dest='dnsTtl',
+	type='float',
+	default=dnsTtl,
+	help='Seconds to cache name lookups [default: %default]',
+	metavar='seconds'
+	)
+
+    parser.add_option_group(group)
+
     (options, args) = parser.parse_args()
 
     if (options.targetHosts is None) | (options.targetPorts is None):
         parser.print_usage()
         parser.exit(1)
 
-    targetHosts = str(options.targetHosts).split(',')
-    targetPorts = str(options.targetPorts).split(',')
+    if (options.concurrency < 1) | (options.hostConcurrency < 1) | (options.dnsConcurrency < 1):
+        parser.error('connection limits must be at least 1')
+
+    if (options.minTimeout <= 0) | (options.maxTimeout < options.minTimeout):
+        parser.error('timeouts must satisfy 0 < --min-timeout <= --max-timeout')
 
-    setdefaulttimeout(timeout)
+    if (options.watch is not None) and (options.watch <= 0):
+        parser.error('--watch interval must be positive')
 
-    for targetHost in targetHosts:
-        print ('\nHost: ' + targetHost + '\n')
-        for targetPort in targetPorts:
-            conn(targetHost, int(targetPort))
+    if (options.status is not None) and (options.watch is None):
+        parser.error('--status requires --watch')
+
+    sinks = []
+    try:
+        for spec in options.outputs:
+            sinks.append(openSink(spec))
+        if not (options.quiet or options.outputs):
+            sinks.append(TerminalSink(sys.stdout))
+        targets = lambda: expandTargets(options.targetHosts, options.targetPorts, options.concurrency)
+        asyncio.run(run(targets, options, sinks))
+    except (ValueError, IOError) as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        parser.exit(130)
+    finally:
+        for sink in sinks:
+            sink.close()
+            if sink.out is not sys.stdout:
+                sink.out.close()
 
 if __name__ == '__main__':
     main()